@@ -0,0 +1,80 @@
+"""
+Measures how long `import itsne` takes in a fresh interpreter, and checks it
+does not import heavy dependencies (sklearn, bokeh, PIL, scipy, ...), which
+should only be imported by the stage that needs them. Exits with status 1 if
+any is imported, or if the median import time exceeds --max-seconds.
+
+Usage (from this directory):
+    python bench_import.py --repeat 5 --output import_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# modules only the stages using them may import
+HEAVY_MODULES = ['sklearn', 'scipy', 'bokeh', 'PIL', 'pandas', 'openTSNE']
+
+_SCRIPT = """
+import json, sys, time
+start = time.time()
+import %s
+elapsed = time.time() - start
+heavy = sorted(m for m in %r if m in sys.modules)
+print(json.dumps({'seconds': elapsed, 'heavy_modules': heavy}))
+"""
+
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def time_import(module='itsne'):
+    """Imports `module` in a new python process. Returns dict of the import
+    time in seconds and the heavy modules it imported"""
+    out = subprocess.check_output(
+        [sys.executable, '-c', _SCRIPT % (module, HEAVY_MODULES)],
+        cwd=root_dir)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--modules', nargs='*',
+                        default=['itsne', 'itsne.batch',
+                                 'itsne.landmarks'],
+                        help="modules to import")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="number of fresh interpreters per module")
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help="fail if a median import time exceeds this")
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    results = {'time': time.time(), 'python': sys.version,
+               'platform': platform.platform(), 'modules': {}}
+    failed = False
+    for module in args.modules:
+        runs = [time_import(module) for _ in range(args.repeat)]
+        seconds = sorted(r['seconds'] for r in runs)
+        median = seconds[len(seconds) // 2]
+        heavy = runs[0]['heavy_modules']
+        print("import %-24s median=%7.3fs min=%7.3fs heavy=%s"
+              % (module, median, seconds[0], ', '.join(heavy) or '-'))
+        results['modules'][module] = {'seconds': seconds, 'median': median,
+                                      'heavy_modules': heavy}
+        if heavy or (args.max_seconds is not None
+                     and median > args.max_seconds):
+            failed = True
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("wrote %s" % args.output)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
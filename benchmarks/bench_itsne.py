@@ -0,0 +1,186 @@
+"""
+Benchmarks each stage of `itsne.plot_tsne` on synthetic data of increasing
+size (and on the bundled MNIST csv), recording wall time, cpu time, peak
+python memory and resident set size per stage to a json file, for comparison
+across commits.
+
+Usage (from this directory):
+    python bench_itsne.py --sizes 1000 5000 20000 --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+_cpu_time = getattr(time, 'process_time', None) or time.clock
+
+# itsne imports, from the checkout this file lives in
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from itsne import itsne
+from itsne.embedders import get_embedder
+from itsne.clustering import get_clusterer
+from itsne.instrument import StageProfiler, rss_bytes
+from itsne.utils import bokeh_utils, colors, utils
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        'data')
+
+
+def _rss_delta(start, end):
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+def timed(fn, *args, **kwargs):
+    """Returns (fn(*args, **kwargs), stats), where stats holds wall & cpu
+    time in seconds, the peak memory allocated by python (bytes) while
+    running fn and the change in resident set size (bytes), which also
+    counts native allocations tracemalloc does not see"""
+    if tracemalloc is not None:
+        tracemalloc.start()
+    rss = rss_bytes()
+    wall, cpu = time.time(), _cpu_time()
+    ret = fn(*args, **kwargs)
+    stats = {'wall': time.time() - wall, 'cpu': _cpu_time() - cpu,
+             'peak_bytes': None, 'rss_delta_bytes': _rss_delta(rss,
+                                                              rss_bytes())}
+    if tracemalloc is not None:
+        stats['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return ret, stats
+
+
+def profiled(name, fn, *args, **kwargs):
+    """Like `timed`, for functions accepting a `profiler`. Returns
+    (fn(*args, **kwargs), stages), where stages holds the stats of the whole
+    call under `name` and of each of its own stages under `name.stage`
+    (summed over repeated stages, e.g. one atlas per zoom level)"""
+    profiler = StageProfiler()
+    ret, stats = timed(fn, *args, profiler=profiler, **kwargs)
+    stages = {name: stats}
+    for r in profiler.records:
+        s = stages.setdefault('%s.%s' % (name, r['stage']),
+                              {'wall': 0., 'cpu': 0., 'peak_bytes': None,
+                               'rss_delta_bytes': 0})
+        s['wall'] += r['wall']
+        s['cpu'] += r['cpu']
+        delta = _rss_delta(r['rss_start_bytes'], r['rss_end_bytes'])
+        if delta is None or s['rss_delta_bytes'] is None:
+            s['rss_delta_bytes'] = None
+        else:
+            s['rss_delta_bytes'] += delta
+    return ret, stages
+
+
+def synthetic(n_samples, n_features=50, n_labels=10, img_size=28, seed=0):
+    """Returns (X, labels, imgs) of gaussian blobs with random thumbnails"""
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(n_labels, n_features).astype(np.float32) * 5
+    labels = rng.randint(0, n_labels, n_samples)
+    X = centers[labels] + rng.randn(n_samples, n_features).astype(np.float32)
+    imgs = rng.randint(0, 256, (n_samples, img_size, img_size)).astype(
+        np.uint8)
+    return X, labels, imgs
+
+
+def mnist():
+    """Returns (X, labels, imgs) of the bundled MNIST csv"""
+    import pandas as pd
+    df = pd.read_csv(os.path.join(data_dir, 'mnist_train_raw_pixels.csv'))
+    df.pop('uid')
+    labels = df.pop('label').values
+    X = df.values.astype(np.float32)
+    imgs = X.reshape(-1, 28, 28).astype(np.uint8)
+    return X, labels, imgs
+
+
+def bench_stages(X, labels, imgs, embedder='sklearn', n_clusters=10,
+                 n_per_cluster=50):
+    """Times every stage of plot_tsne separately. Returns dict of
+    stage name -> stats"""
+    res = {}
+    xy, res['embed'] = timed(get_embedder(embedder), X)
+    _, res['cluster'] = timed(get_clusterer('kmeans'), X,
+                              n_clusters=n_clusters, random_state=0)
+    idxs, res['sample_n_per_label'] = timed(utils.sample_n_per_label, labels,
+                                            n_per_cluster, random_state=0)
+    c_arr, res['get_color_arr'] = timed(colors.get_color_arr, labels,
+                                        normed=False)
+    _, res['rgb_to_hex'] = timed(colors.rgb_to_hex, c_arr)
+    _, res['preproc_imgs'] = timed(bokeh_utils.preproc_imgs, imgs)
+
+    result = itsne.compute_tsne(X, labels=labels, xy=xy,
+                                n_per_cluster=n_per_cluster, random_state=0)
+    # figure construction, image preprocessing, atlas packing and saving
+    # are reported separately through the render profiler
+    out_dir = tempfile.mkdtemp()
+    res.update(profiled('render_circles', itsne.render_tsne,
+                        os.path.join(out_dir, 'circles.html'), result)[1])
+    res.update(profiled('render_imgs', itsne.render_tsne,
+                        os.path.join(out_dir, 'imgs.html'), result,
+                        imgs=imgs)[1])
+    return res
+
+
+def git_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            ).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='*',
+                        default=[1000, 5000, 20000],
+                        help="numbers of synthetic samples to benchmark")
+    parser.add_argument('--n-features', type=int, default=50)
+    parser.add_argument('--embedder', default='sklearn')
+    parser.add_argument('--no-mnist', action='store_true',
+                        help="skip the bundled MNIST dataset")
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args(argv)
+
+    datasets = [('synthetic_%i' % n, lambda n=n: synthetic(
+        n, n_features=args.n_features)) for n in args.sizes]
+    if not args.no_mnist:
+        datasets.append(('mnist', mnist))
+
+    results = {'revision': git_revision(), 'time': time.time(),
+               'python': sys.version, 'platform': platform.platform(),
+               'embedder': args.embedder, 'datasets': {}}
+    for name, load in datasets:
+        X, labels, imgs = load()
+        print("benchmarking %s: X.shape = %s" % (name, X.shape))
+        stages = bench_stages(X, labels, imgs, embedder=args.embedder)
+        for stage, stats in sorted(stages.items()):
+            print("    %-28s wall=%8.3fs cpu=%8.3fs peak=%s rss=%s"
+                  % (stage, stats['wall'], stats['cpu'], stats['peak_bytes'],
+                     stats['rss_delta_bytes']))
+        results['datasets'][name] = {'shape': list(X.shape),
+                                     'stages': stages}
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("wrote %s" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,11 @@ from subset of MNIST dataset, using raw-pixel values for features.
 Plots each datapoints as bokeh circles.
 """
 import os
-import pandas as pd
+import numpy as np
 
 # itsne imports
 from itsne import itsne
+from itsne.utils import datasets
 
 # set up paths
 output_path = 'outputs/mnist_circles.html'
@@ -17,11 +18,12 @@ output_path = 'outputs/mnist_circles.html'
 data_dir = '../data'
 data_path = os.path.join(data_dir, 'mnist_train_raw_pixels.csv')
 
-# load from data
-df = pd.read_csv(data_path)
-uids = df.pop('uid')
-labels = df.pop('label')
+# convert csv once to memory-mappable .npy files, then load with zero copy
+npy_dir = os.path.join(data_dir, 'mnist_npy')
+if not os.path.exists(npy_dir):
+    datasets.csv_to_npy(data_path, npy_dir, dtype=np.uint8)
+X, uids, labels, _ = datasets.load_npy_dataset(npy_dir)
 
 # plot itsne in bokeh
-xy = itsne.plot_tsne(output_path, df.values, uids=uids,
+xy = itsne.plot_tsne(output_path, X, uids=uids,
                      labels=labels, imgs=None, n_per_cluster=None)
@@ -0,0 +1,286 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Renders many itsne plots of the same features in parallel on a process pool.
+
+The feature matrix is shared with the workers as a read-only memmap instead
+of being pickled to every one of them, and work common to several plots
+(feature subsets, dimensionality reduction, nearest neighbor graphs) is done
+once up front.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# local imports
+from .itsne import plot_tsne
+from .embedders import get_embedder, embedder_name
+from .neighbors import knn_graph, n_neighbors_for
+from .reduction import reduce_dims
+from .utils.utils import issparse
+
+# arrays shared with the current worker process, see `_init_worker`
+_SHARED = {}
+
+
+def _share_array(arr, work_dir, name):
+    """Returns a descriptor of `arr` that worker processes open as a
+    read-only memmap with `_open_array`. Memmaps of a whole file (e.g. from
+    `utils.datasets.load_npy_dataset`) are reused as is, anything else is
+    written once to `work_dir`. Sparse matrices are shared as their CSR
+    components"""
+    if issparse(arr):
+        arr = arr.tocsr()
+        return ('csr', arr.shape) + tuple(
+            _share_array(getattr(arr, k), work_dir, '%s_%s' % (name, k))
+            for k in ('data', 'indices', 'indptr'))
+
+    if (isinstance(arr, np.memmap) and arr.filename is not None
+            and not isinstance(arr.base, np.ndarray)
+            and arr.flags.c_contiguous):
+        return ('memmap', arr.filename, arr.dtype.str, arr.shape, arr.offset)
+
+    path = os.path.join(work_dir, '%s.npy' % name)
+    np.save(path, np.asarray(arr))
+    return ('npy', path)
+
+
+def _open_array(desc):
+    if desc[0] == 'csr':
+        from scipy.sparse import csr_matrix
+        return csr_matrix(tuple(_open_array(d) for d in desc[2:]),
+                          shape=desc[1], copy=False)
+    if desc[0] == 'memmap':
+        _, filename, dtype, shape, offset = desc
+        return np.memmap(filename, dtype=dtype, mode='r', shape=shape,
+                         offset=offset)
+    return np.load(desc[1], mmap_mode='r')
+
+
+def _init_worker(shared):
+    """Opens the shared arrays once per worker process"""
+    _SHARED.clear()
+    for name, value in shared.items():
+        if isinstance(value, tuple) and value[0] in ('memmap', 'npy', 'csr'):
+            value = _open_array(value)
+        _SHARED[name] = value
+
+
+def _run_config(task):
+    """Runs `plot_tsne` for one configuration in a worker process"""
+    config, features, knn = task
+    kwargs = dict(config)
+    output_path = kwargs.pop('output_path')
+    kwargs.pop('columns', None)
+    for name in ('uids', 'labels', 'imgs'):
+        if name not in kwargs:
+            kwargs[name] = _SHARED.get(name)
+    if knn is not None:
+        kwargs['knn'] = (_SHARED[knn + '_indices'],
+                         _SHARED[knn + '_distances'])
+    return plot_tsne(output_path, _SHARED[features], **kwargs)
+
+
+def _features_key(config):
+    """Identifies the features a configuration embeds"""
+    columns = config.get('columns')
+    if columns is not None:
+        columns = [int(c) for c in np.asarray(columns).ravel()]
+    return json.dumps([columns, config.get('reducer'),
+                       config.get('reduce_kwargs')], sort_keys=True,
+                      default=str)
+
+
+def _uses_knn(config):
+    """Whether the embedding of `config` would search nearest neighbors
+    that can be shared with other configurations"""
+    if (config.get('xy') is not None or 'knn' in config
+            or config.get('precomputed')):
+        return False
+    embed_kwargs = config.get('embed_kwargs') or {}
+    if embed_kwargs.get('metric', 'euclidean') != 'euclidean':
+        return False
+    embed_fn = get_embedder(config.get('embedder', 'sklearn'))
+    return getattr(embed_fn, 'supports_knn', False)
+
+
+def plot_tsne_batch(configs, X, uids=None, labels=None, imgs=None,
+                    n_jobs=None, share_knn=True, work_dir=None):
+    """Runs `plot_tsne` for every configuration of `configs` in parallel,
+    e.g. to render maps of the same data with different perplexities,
+    feature subsets or label sets.
+
+    X (and `imgs`, if an array) is shared with the worker processes through
+    a memory-mapped file rather than copied to each of them: memmaps of a
+    whole .npy file (see `utils.datasets.load_npy_dataset`) are used as is,
+    other arrays are written once to `work_dir`. Before the workers start,
+    every distinct feature subset and dimensionality reduction is computed
+    once, and so is the nearest neighbor graph of every set of features
+    embedded by more than one configuration (see `neighbors.knn_graph`).
+
+    Parameters
+    ------
+    configs: list of dict
+        One dict per plot, of `plot_tsne` keyword arguments (`n_clusters`,
+        `n_per_cluster`, `img_alpha`, `embedder`, `embed_kwargs`, `reducer`,
+        `random_state`, `cache`, ...). Each must have an `output_path`, and
+        may have `columns`, indexes of the columns of X to embed, and
+        `uids`, `labels` or `imgs` to override the shared ones.
+
+    X: array or scipy.sparse matrix, shape (n_samples, n_features)
+        Feature array shared by all configurations, or a sparse nearest
+        neighbor graph if they are `precomputed`.
+
+    uids: array, shape (n_samples,), default=None
+        Uids shared by all configurations, see `plot_tsne`.
+
+    labels: array, shape (n_samples,), default=None
+        Labels shared by all configurations, see `plot_tsne`.
+
+    imgs: array or `utils.images.ImageSource`, default=None
+        Images shared by all configurations, see `plot_tsne`.
+
+    n_jobs: int, default=None
+        Number of worker processes. If None, the number of cpus. With
+        `embedder='fast'`, the threads of each embedding default to the
+        cpus left per worker, so the pool does not oversubscribe them.
+
+    share_knn: bool, default=True
+        Whether to compute nearest neighbor graphs once for configurations
+        embedding the same features with a built-in embedder.
+
+    work_dir: str, default=None
+        Directory for the shared files. If None, a temporary directory is
+        used and removed afterwards.
+
+    Returns
+    ------
+    xys: list of ndarray of shape (n_samples, 2)
+        Output of `plot_tsne` for each configuration, in order.
+
+    Raises
+    ------
+    RuntimeError:
+        Error checking configurations, or any error of `plot_tsne`.
+    """
+    configs = [dict(config) for config in configs]
+    for i, config in enumerate(configs):
+        if 'output_path' not in config:
+            raise RuntimeError("configs[%i] has no output_path" % i)
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = max(1, min(n_jobs, len(configs)))
+
+    tmp_dir = None
+    if work_dir is None:
+        work_dir = tmp_dir = tempfile.mkdtemp(prefix='itsne_batch_')
+    elif not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+
+    try:
+        shared = {'X': _share_array(X, work_dir, 'X'), 'uids': uids,
+                  'labels': labels}
+        if isinstance(imgs, np.ndarray):
+            shared['imgs'] = _share_array(imgs, work_dir, 'imgs')
+        else:
+            shared['imgs'] = imgs
+
+        # group configurations by the features they embed
+        groups = {}
+        for i, config in enumerate(configs):
+            groups.setdefault(_features_key(config), []).append(i)
+
+        tasks = [None] * len(configs)
+        for g, members in enumerate(sorted(groups.values())):
+            first = configs[members[0]]
+            features = 'X'
+            if (first.get('columns') is not None
+                    or first.get('reducer') is not None):
+                F = X
+                if first.get('columns') is not None:
+                    F = X[:, np.asarray(first['columns'])]
+                if first.get('reducer') is not None:
+                    F = reduce_dims(F, method=first['reducer'],
+                                    **(first.get('reduce_kwargs') or {}))
+                features = 'features_%i' % g
+                shared[features] = _share_array(F, work_dir, features)
+                for i in members:
+                    configs[i].pop('reducer', None)
+                    configs[i].pop('reduce_kwargs', None)
+            else:
+                F = X
+
+            knn = None
+            knn_members = [i for i in members if _uses_knn(configs[i])]
+            if share_knn and len(knn_members) > 1:
+                k = max(n_neighbors_for((configs[i].get('embed_kwargs') or
+                                         {}).get('perplexity', 30.))
+                        for i in knn_members)
+                indices, distances = knn_graph(F, n_neighbors=k)
+                knn = 'knn_%i' % g
+                shared[knn + '_indices'] = _share_array(
+                    indices, work_dir, knn + '_indices')
+                shared[knn + '_distances'] = _share_array(
+                    distances, work_dir, knn + '_distances')
+            del F
+
+            for i in members:
+                tasks[i] = (configs[i], features,
+                            knn if i in knn_members else None)
+
+        # multi-threaded embedders get the cpus left per worker
+        n_threads = max(1, multiprocessing.cpu_count() // n_jobs)
+        for config, _, _ in tasks:
+            if embedder_name(config.get('embedder', 'sklearn')) == 'fast':
+                embed_kwargs = dict(config.get('embed_kwargs') or {})
+                embed_kwargs.setdefault('n_jobs', n_threads)
+                config['embed_kwargs'] = embed_kwargs
+
+        if n_jobs == 1:
+            _init_worker(shared)
+            return [_run_config(task) for task in tasks]
+
+        pool = multiprocessing.Pool(n_jobs, initializer=_init_worker,
+                                    initargs=(shared,))
+        try:
+            return pool.map(_run_config, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _SHARED.clear()
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,146 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Clustering engines used to label data when no labels are provided.
+
+Each engine is a function `f(X, n_clusters=10, random_state=None, **kwargs)`
+that returns an integer label per row of X. Engines are looked up by name from
+`CLUSTERERS`, and new ones can be added with `register_clusterer`.
+
+X may be dense or scipy.sparse. Engines that can also cluster a precomputed
+sparse distance graph (`supports_precomputed`) take `metric='precomputed'`,
+and engines that can work in place on an X nobody else uses
+(`supports_copy_x`) take `copy_x=False`.
+"""
+import numpy as np
+
+from .utils.utils import read_rows
+
+
+def kmeans(X, n_clusters=10, random_state=None, **kwargs):
+    """Full-batch KMeans from scikit-learn. With `copy_x=False`, X is
+    centered in place (and restored) instead of copied"""
+    from sklearn.cluster import KMeans
+    return KMeans(n_clusters=n_clusters, random_state=random_state,
+                  **kwargs).fit_predict(X)
+
+
+kmeans.supports_copy_x = True
+
+
+def fit_minibatch_kmeans(X, n_clusters=10, random_state=None,
+                         chunk_size=10000, n_epochs=3, **kwargs):
+    """Returns a MiniBatchKMeans fitted with `partial_fit` over chunks of
+    `chunk_size` rows for `n_epochs` passes"""
+    from sklearn.cluster import MiniBatchKMeans
+
+    model = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state,
+                            **kwargs)
+    # each chunk must have at least n_clusters rows
+    chunk_size = max(chunk_size, n_clusters)
+    n_samples = X.shape[0]
+    starts = list(range(0, n_samples, chunk_size))
+    if len(starts) > 1 and n_samples - starts[-1] < n_clusters:
+        starts.pop()
+    stops = starts[1:] + [n_samples]
+
+    rng = np.random.RandomState(random_state)
+    for _ in range(n_epochs):
+        for i in rng.permutation(len(starts)):
+            model.partial_fit(read_rows(X, starts[i], stops[i]))
+    return model
+
+
+def minibatch_kmeans(X, n_clusters=10, random_state=None, chunk_size=10000,
+                     n_epochs=3, **kwargs):
+    """Streaming KMeans. Fits with `partial_fit` over chunks of
+    `chunk_size` rows for `n_epochs` passes, then predicts chunk by chunk,
+    so X may be a memmap larger than memory"""
+    model = fit_minibatch_kmeans(X, n_clusters=n_clusters,
+                                 random_state=random_state,
+                                 chunk_size=chunk_size, n_epochs=n_epochs,
+                                 **kwargs)
+    n_samples = X.shape[0]
+    lbls = np.empty(n_samples, dtype=np.int32)
+    for start in range(0, n_samples, chunk_size):
+        lbls[start:start + chunk_size] = model.predict(
+            read_rows(X, start, start + chunk_size))
+    return lbls
+
+
+def dbscan(X, n_clusters=None, random_state=None, eps=None, min_samples=10,
+           n_jobs=-1, metric='euclidean', **kwargs):
+    """Density-based clustering (DBSCAN) over the kNN graph of X. Meant for
+    the 2-d embedding, where clusters are dense blobs. `n_clusters` is
+    ignored. If `eps` is None, uses twice the median distance to the
+    `min_samples`-th nearest neighbor. Noise points are labeled -1. With
+    `metric='precomputed'`, X is a sparse distance graph and only its stored
+    entries are considered neighbors"""
+    from sklearn.cluster import DBSCAN
+    from sklearn.neighbors import NearestNeighbors
+
+    if eps is None:
+        nn = NearestNeighbors(n_neighbors=min_samples, metric=metric,
+                              n_jobs=n_jobs).fit(X)
+        dists, _ = nn.kneighbors(X)
+        eps = 2. * np.median(dists[:, -1])
+    return DBSCAN(eps=eps, min_samples=min_samples, metric=metric,
+                  n_jobs=n_jobs, **kwargs).fit_predict(X)
+
+
+dbscan.supports_precomputed = True
+
+
+CLUSTERERS = {'kmeans': kmeans,
+              'minibatch_kmeans': minibatch_kmeans,
+              'dbscan': dbscan}
+
+
+def register_clusterer(name, func):
+    """Registers clustering function `func(X, n_clusters, random_state,
+    **kwargs)` under `name` so it can be selected with
+    `plot_tsne(..., clusterer=name)`"""
+    if not callable(func):
+        raise RuntimeError("clusterer %s is not callable" % name)
+    CLUSTERERS[name] = func
+
+
+def get_clusterer(clusterer):
+    """Returns the clustering function for `clusterer`, which is either a name
+    registered in `CLUSTERERS` or a callable"""
+    if callable(clusterer):
+        return clusterer
+    if clusterer not in CLUSTERERS:
+        raise RuntimeError("Do not recognize clusterer = %s. Choose one of %s"
+                           % (clusterer, sorted(CLUSTERERS.keys())))
+    return CLUSTERERS[clusterer]
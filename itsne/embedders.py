@@ -0,0 +1,334 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Embedding engines used to collapse features down to 2-dimensions.
+
+Each engine is a function `f(X, **kwargs)` that returns an ndarray of shape
+(n_samples, n_components). Engines are looked up by name from `EMBEDDERS`,
+and new ones can be added with `register_embedder`.
+
+The built-in engines accept dense or scipy.sparse X, and precomputed nearest
+neighbors `knn=(indices, distances)` (see `neighbors`), in which case X may
+be None.
+"""
+import warnings
+import numpy as np
+
+from .neighbors import check_knn, knn_graph, knn_to_csr, n_neighbors_for
+from .utils.utils import issparse
+
+
+# PCA initializations are fit on at most this many rows of X, so that they
+# never copy all of a large X
+_PCA_INIT_MAX_SAMPLES = 50000
+
+
+def _pca_init(X, n_components, random_state, chunk_size=10000):
+    """Same initial coordinates as `TSNE(init='pca')` of scikit-learn, but
+    fit on a random subset of at most 50000 rows and applied chunk by chunk.
+    For sparse X, uses the (uncentered) truncated SVD instead, which never
+    densifies X"""
+    from sklearn.decomposition import PCA, TruncatedSVD
+
+    n_samples = X.shape[0]
+    X_fit = X
+    if n_samples > _PCA_INIT_MAX_SAMPLES:
+        rng = np.random.RandomState(random_state)
+        X_fit = X[np.sort(rng.choice(n_samples, _PCA_INIT_MAX_SAMPLES,
+                                     replace=False))]
+    if issparse(X):
+        model = TruncatedSVD(n_components=n_components,
+                             random_state=random_state)
+    else:
+        model = PCA(n_components=n_components, svd_solver='randomized',
+                    random_state=random_state)
+    model.fit(X_fit)
+    del X_fit
+
+    pca = np.empty((n_samples, n_components), dtype=np.float32)
+    for start in range(0, n_samples, chunk_size):
+        pca[start:start + chunk_size] = model.transform(
+            X[start:start + chunk_size])
+    pca *= 1e-4 / np.std(pca[:, 0])
+    return pca
+
+
+def _is_pca(init):
+    """Whether initialization `init`, a str or an array, is 'pca'"""
+    return isinstance(init, str) and init == 'pca'
+
+
+def _n_samples(X):
+    return None if X is None else X.shape[0]
+
+
+def sklearn_tsne(X, n_components=2, callback=None, callback_every=None,
+                 knn=None, **kwargs):
+    """t-SNE from scikit-learn (Barnes-Hut by default). `kwargs` are passed
+    to `sklearn.manifold.TSNE`. If provided, the (indices, distances)
+    nearest neighbors `knn` of X (see `neighbors.knn_graph`) are used
+    instead of searching them again.
+
+    scikit-learn has no progress hook, so by default `callback(iteration,
+    kl_divergence, xy)` is only called once at the end. With
+    `callback_every`, the optimization instead runs in segments of
+    `max(callback_every, 300)` iterations, each restarted from the layout
+    of the previous one (with the same neighbors and learning rate, but
+    fresh momentum), calling `callback` after each and stopping early if it
+    returns True. If `knn` has too few neighbors for `perplexity`, the
+    perplexity is lowered to what they support, with a warning"""
+    if knn is not None:
+        kwargs = _knn_perplexity(knn, kwargs)
+    if callback is not None and callback_every is not None:
+        return _sklearn_tsne_segments(X, n_components, callback,
+                                      callback_every, knn, kwargs)
+
+    xy, tsne = _sklearn_fit(X, n_components, knn, kwargs)
+    if callback is not None:
+        callback(getattr(tsne, 'n_iter_', None),
+                 getattr(tsne, 'kl_divergence_', None), xy)
+    return xy
+
+
+def _knn_perplexity(knn, kwargs):
+    """Returns `kwargs` with `perplexity` lowered to the largest that the
+    neighbors per row of `knn` support, scikit-learn needing
+    `n_neighbors_for(perplexity)` of them"""
+    n_neighbors = np.shape(knn[0])[1]
+    perplexity = kwargs.get('perplexity', 30.)
+    if n_neighbors >= n_neighbors_for(perplexity):
+        return kwargs
+    if n_neighbors < 2:
+        raise RuntimeError("t-SNE needs at least 2 neighbors per sample, "
+                           "got %i" % n_neighbors)
+    lowered = (n_neighbors - 1) / 3.
+    warnings.warn("%i neighbors per sample are too few for perplexity %s, "
+                  "which needs %i; using perplexity %.2f instead"
+                  % (n_neighbors, perplexity, n_neighbors_for(perplexity),
+                     lowered))
+    return dict(kwargs, perplexity=lowered)
+
+
+def _sklearn_fit(X, n_components, knn, kwargs):
+    """Returns (xy, fitted sklearn.manifold.TSNE)"""
+    from sklearn.manifold import TSNE
+
+    kwargs = dict(kwargs)
+    init = kwargs.get('init', 'pca')
+    if X is None:
+        if knn is None:
+            raise RuntimeError("Either X or knn must be provided")
+        # no features to initialize from
+        kwargs.setdefault('init', 'random')
+    elif _is_pca(init):
+        # scikit-learn can't PCA-initialize from sparse or precomputed X,
+        # and would copy all of X to do it otherwise
+        kwargs['init'] = _pca_init(X, n_components,
+                                   kwargs.get('random_state'))
+
+    if knn is not None:
+        indices, distances = check_knn(knn, _n_samples(X))
+        k = n_neighbors_for(kwargs.get('perplexity', 30.))
+        # scikit-learn works on squared euclidean distances
+        X = knn_to_csr(indices, distances, n_neighbors=k, squared=True)
+        kwargs['metric'] = 'precomputed'
+
+    tsne = TSNE(n_components=n_components, **kwargs)
+    return tsne.fit_transform(X), tsne
+
+
+def _sk_iter_param():
+    """Name of the iteration count parameter of sklearn.manifold.TSNE,
+    renamed in scikit-learn 1.5"""
+    from sklearn.manifold import TSNE
+    return 'max_iter' if 'max_iter' in TSNE().get_params() else 'n_iter'
+
+
+# scikit-learn always runs 250 iterations with early exaggeration first, and
+# only reports the KL divergence of the iterations after
+_SK_MIN_SEGMENT = 300
+
+
+def _sklearn_tsne_segments(X, n_components, callback, callback_every, knn,
+                           kwargs):
+    """`sklearn_tsne` in resumable segments, see its `callback_every`"""
+    kwargs = dict(kwargs)
+    sk_iter = _sk_iter_param()
+    n_iter = kwargs.pop(sk_iter, None) or 1000
+    segment = max(callback_every, _SK_MIN_SEGMENT)
+
+    # search neighbors once rather than on every segment
+    if knn is None:
+        knn = knn_graph(X, n_neighbors=n_neighbors_for(
+            kwargs.get('perplexity', 30.)),
+            n_jobs=kwargs.get('n_jobs') or 1)
+    n_samples = len(knn[0])
+
+    # later segments run without early exaggeration, but keep the step size
+    # of the first one
+    if kwargs.get('learning_rate', 'auto') == 'auto':
+        kwargs['learning_rate'] = max(
+            n_samples / kwargs.get('early_exaggeration', 12.) / 4., 50.)
+
+    xy, it = None, 0
+    while it < n_iter:
+        seg_kwargs = dict(kwargs)
+        # a remainder too short for a segment of its own joins the last one
+        seg_kwargs[sk_iter] = segment
+        if n_iter - it < segment + _SK_MIN_SEGMENT:
+            seg_kwargs[sk_iter] = max(n_iter - it, _SK_MIN_SEGMENT)
+        if xy is not None:
+            seg_kwargs.update(init=xy, early_exaggeration=1.)
+        xy, tsne = _sklearn_fit(X, n_components, knn, seg_kwargs)
+        it += tsne.n_iter_ + 1
+        # scikit-learn stops a segment early once converged
+        converged = tsne.n_iter_ + 1 < seg_kwargs[sk_iter]
+        if callback(it, tsne.kl_divergence_, xy) or converged:
+            break
+
+    return xy
+
+
+def _phase_counter(callback, early_exaggeration_iter):
+    """Wraps `callback` for openTSNE, which counts iterations from 1 again
+    after early exaggeration, so it sees iterations of the whole run"""
+    state = {'last': 0, 'offset': 0}
+
+    def wrapped(iteration, kl_divergence, embedding):
+        if iteration <= state['last']:
+            state['offset'] = early_exaggeration_iter
+        state['last'] = iteration
+        return callback(state['offset'] + iteration, kl_divergence,
+                        np.array(embedding))
+    return wrapped
+
+
+def fast_tsne(X, n_components=2, perplexity=30, n_jobs=-1,
+              neighbors='auto', negative_gradient_method='auto',
+              random_state=None, callback=None, callback_every=50,
+              knn=None, **kwargs):
+    """t-SNE using openTSNE: approximate nearest neighbors for the
+    affinities and FFT-interpolated (or Barnes-Hut for small n) gradients,
+    multi-threaded over `n_jobs` cores. `kwargs` are passed to
+    `openTSNE.TSNE`. If provided, `callback(iteration, kl_divergence, xy)`
+    is called every `callback_every` iterations, stopping the optimization
+    early if it returns True, and the (indices, distances)
+    nearest neighbors `knn` of X (see `neighbors.knn_graph`) are used
+    instead of searching them again. Neighbors of sparse X are searched
+    exactly with `neighbors.knn_graph`"""
+    try:
+        import openTSNE
+        from openTSNE.affinity import PerplexityBasedNN
+        from openTSNE.nearest_neighbors import PrecomputedNeighbors
+    except ImportError:
+        raise RuntimeError("embedder='fast' requires openTSNE to be "
+                           "installed (pip install openTSNE)")
+
+    if callback is not None:
+        kwargs['callbacks'] = _phase_counter(
+            callback, kwargs.get('early_exaggeration_iter', 250))
+        kwargs['callbacks_every_iters'] = callback_every
+
+    if X is None:
+        if knn is None:
+            raise RuntimeError("Either X or knn must be provided")
+        # no features to initialize from
+        kwargs.setdefault('initialization', 'spectral')
+    elif (not issparse(X) and X.shape[0] > _PCA_INIT_MAX_SAMPLES
+            and _is_pca(kwargs.get('initialization', 'pca'))):
+        # openTSNE would copy all of X to PCA-initialize
+        kwargs['initialization'] = _pca_init(X, n_components, random_state)
+    elif issparse(X):
+        if knn is None:
+            knn = knn_graph(X, n_neighbors=n_neighbors_for(perplexity) - 1,
+                            n_jobs=n_jobs)
+        if _is_pca(kwargs.get('initialization', 'pca')):
+            kwargs['initialization'] = _pca_init(X, n_components,
+                                                 random_state)
+        # everything openTSNE needs from X is now precomputed
+        X = None
+
+    tsne = openTSNE.TSNE(n_components=n_components, perplexity=perplexity,
+                         n_jobs=n_jobs, neighbors=neighbors,
+                         negative_gradient_method=negative_gradient_method,
+                         random_state=random_state, **kwargs)
+    if knn is None:
+        return np.asarray(tsne.fit(X))
+
+    indices, distances = check_knn(knn, _n_samples(X))
+    k = n_neighbors_for(perplexity) - 1
+    affinities = PerplexityBasedNN(
+        perplexity=perplexity, n_jobs=n_jobs, random_state=random_state,
+        knn_index=PrecomputedNeighbors(np.asarray(indices[:, :k]),
+                                       np.asarray(distances[:, :k])))
+    return np.asarray(tsne.fit(X, affinities=affinities))
+
+
+# built-in embedders accept a `callback(iteration, kl_divergence, xy)`
+# argument, which can stop them by returning True, and precomputed nearest
+# neighbors `knn`
+sklearn_tsne.supports_callback = True
+fast_tsne.supports_callback = True
+sklearn_tsne.supports_knn = True
+fast_tsne.supports_knn = True
+
+
+EMBEDDERS = {'sklearn': sklearn_tsne,
+             'fast': fast_tsne}
+
+
+def register_embedder(name, func):
+    """Registers embedding function `func(X, **kwargs)` under `name` so it
+    can be selected with `plot_tsne(..., embedder=name)`"""
+    if not callable(func):
+        raise RuntimeError("embedder %s is not callable" % name)
+    EMBEDDERS[name] = func
+
+
+def get_embedder(embedder):
+    """Returns the embedding function for `embedder`, which is either a name
+    registered in `EMBEDDERS` or a callable"""
+    if callable(embedder):
+        return embedder
+    if embedder not in EMBEDDERS:
+        raise RuntimeError("Do not recognize embedder = %s. Choose one of %s"
+                           % (embedder, sorted(EMBEDDERS.keys())))
+    return EMBEDDERS[embedder]
+
+
+def embedder_name(embedder):
+    """Returns a name identifying `embedder`, e.g. for cache keys"""
+    if callable(embedder):
+        return '%s.%s' % (getattr(embedder, '__module__', ''),
+                          getattr(embedder, '__name__', repr(embedder)))
+    return embedder
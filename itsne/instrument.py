@@ -0,0 +1,282 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Instrumentation hooks reporting time, memory and progress of itsne stages.
+
+`compute_tsne`, `render_tsne` and `plot_tsne` accept a `profiler`. Each stage
+of the pipeline is run inside `profiler.stage(name, **arrays)`, and t-SNE
+optimization progress is reported with `profiler.on_iteration`. The default
+`Profiler` does nothing, so instrumentation costs close to nothing when
+disabled.
+"""
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+_cpu_time = getattr(time, 'process_time', None) or time.clock
+
+
+def rss_bytes():
+    """Returns current resident set size of this process in bytes, or None if
+    not available on this platform (only read from /proc on linux)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _page_size()
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def _page_size():
+    if resource is not None:
+        return resource.getpagesize()
+    return 4096
+
+
+def _reset_peak_rss():
+    """Resets the peak RSS (VmHWM) of this process to its current RSS.
+    Returns whether it could (linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _peak_rss_bytes():
+    """Returns VmHWM of this process in bytes, i.e. its peak RSS since start
+    or since the last `_reset_peak_rss`, or None if not available"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class _RssSampler(threading.Thread):
+    """Polls `rss_bytes` every `interval` seconds in the background and
+    keeps the largest value seen, for when VmHWM can't be reset"""
+    def __init__(self, interval=0.01):
+        super(_RssSampler, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, rss_bytes())
+        return self.peak
+
+
+# stages currently running, outermost first, whose peaks are folded in
+# before an inner stage resets VmHWM
+_open_stages = []
+
+# highest VmHWM seen before any reset, as resetting it also resets ru_maxrss
+_hwm_before_reset = [0]
+
+
+def max_rss_bytes():
+    """Returns peak resident set size of this process in bytes (its high-water
+    mark since start, not of any one stage), or None if not available on
+    this platform"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    rss = rss if sys.platform == 'darwin' else rss * 1024
+    return max(rss, _hwm_before_reset[0])
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler(object):
+    """Base profiler, ignores everything. Subclass and override `stage`,
+    `on_stage_end` and/or `on_iteration` to collect metrics"""
+    def stage(self, name, **arrays):
+        """Returns context manager wrapping stage `name`. `arrays` are named
+        input arrays whose shapes & sizes are reported"""
+        return _NULL_STAGE
+
+    def on_stage_end(self, record):
+        """Called with a dict describing each finished stage"""
+        pass
+
+    def on_iteration(self, iteration, kl_divergence, xy=None):
+        """Called with t-SNE optimization progress, and the current
+        coordinates `xy` if the embedder reports them"""
+        pass
+
+
+class _Stage(object):
+    def __init__(self, profiler, name, arrays):
+        self.profiler = profiler
+        self.name = name
+        self.arrays = arrays
+
+    def __enter__(self):
+        self.rss = rss_bytes()
+        self.peak = self.sampler = None
+        if self.rss is not None:
+            hwm = _peak_rss_bytes()
+            if hwm is not None:
+                _hwm_before_reset[0] = max(_hwm_before_reset[0], hwm)
+                for stage in _open_stages:
+                    if stage.peak is not None:
+                        stage.peak = max(stage.peak, hwm)
+            if hwm is not None and _reset_peak_rss():
+                self.peak = self.rss
+            else:
+                self.sampler = _RssSampler()
+                self.sampler.start()
+        _open_stages.append(self)
+        self.wall = time.time()
+        self.cpu = _cpu_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall, cpu = time.time() - self.wall, _cpu_time() - self.cpu
+        rss = rss_bytes()
+        if self in _open_stages:
+            _open_stages.remove(self)
+        if self.sampler is not None:
+            self.peak = self.sampler.stop()
+        elif self.peak is not None:
+            self.peak = max(self.peak, _peak_rss_bytes())
+        record = {'stage': self.name,
+                  'wall': wall,
+                  'cpu': cpu,
+                  'rss_start_bytes': self.rss,
+                  'rss_end_bytes': rss,
+                  'peak_rss_bytes': self.peak,
+                  'max_rss_bytes': max_rss_bytes(),
+                  'arrays': dict((k, {'shape': list(getattr(v, 'shape', ())),
+                                      'nbytes': getattr(v, 'nbytes', None)})
+                                 for k, v in self.arrays.items()
+                                 if v is not None)}
+        self.profiler.on_stage_end(record)
+        return False
+
+
+class StageProfiler(Profiler):
+    """Records wall time, cpu time, RSS and array sizes of every stage, and
+    t-SNE iterations with their KL divergence.
+
+    Parameters
+    ------
+    callback: callable, default=None
+        If provided, called with every stage record (dict) as it finishes,
+        e.g. to forward to a metrics pipeline.
+
+    iteration_callback: callable, default=None
+        If provided, called as `f(iteration, kl_divergence)` on t-SNE
+        progress.
+
+    Attributes
+    ------
+    records: list of dict
+        One record per finished stage, with keys 'stage', 'wall', 'cpu',
+        'rss_start_bytes' & 'rss_end_bytes' (resident set size before and
+        after the stage, None off linux), 'peak_rss_bytes' (highest resident
+        set size during the stage, from VmHWM reset at its start, else
+        sampled by a background thread, None off linux), 'max_rss_bytes'
+        (high-water mark of the whole process so far, so it only rises when
+        a stage peaks above every earlier one) and 'arrays' (name -> shape &
+        nbytes).
+
+    iterations: list of tuple
+        (iteration, kl_divergence) reported by the embedder.
+    """
+    def __init__(self, callback=None, iteration_callback=None):
+        self.callback = callback
+        self.iteration_callback = iteration_callback
+        self.records = []
+        self.iterations = []
+
+    def stage(self, name, **arrays):
+        return _Stage(self, name, arrays)
+
+    def on_stage_end(self, record):
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def on_iteration(self, iteration, kl_divergence, xy=None):
+        self.iterations.append((iteration, kl_divergence))
+        if self.iteration_callback is not None:
+            self.iteration_callback(iteration, kl_divergence)
+
+    def summary(self):
+        """Returns a human readable table of the stage records"""
+        def mb(n_bytes):
+            return '-' if n_bytes is None else '%.1f' % (n_bytes / 2. ** 20)
+
+        lines = ['%-16s %10s %10s %14s %14s %14s'
+                 % ('stage', 'wall (s)', 'cpu (s)', 'rss delta (MB)',
+                    'peak rss (MB)', 'max rss (MB)')]
+        for r in self.records:
+            delta = None
+            if r['rss_start_bytes'] is not None \
+                    and r['rss_end_bytes'] is not None:
+                delta = r['rss_end_bytes'] - r['rss_start_bytes']
+            lines.append('%-16s %10.3f %10.3f %14s %14s %14s'
+                         % (r['stage'], r['wall'], r['cpu'], mb(delta),
+                            mb(r['peak_rss_bytes']),
+                            mb(r['max_rss_bytes'])))
+        return '\n'.join(lines)
+
+
+NULL_PROFILER = Profiler()
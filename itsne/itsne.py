@@ -33,28 +33,133 @@
 """
 Interactive visualizations of data using t-SNE clustering with Bokeh
 """
-import bokeh.plotting as bkp
-import bokeh.models as bkm
 import numpy as np
-from sklearn.manifold import TSNE
-from sklearn.cluster import KMeans
 
 # local imports
-from utils import colors, bokeh_utils, utils
+from .utils import colors, bokeh_utils, utils
+from .embedders import get_embedder, embedder_name
+from . import landmarks  # noqa: F401, registers embedder 'landmark'
+from .clustering import get_clusterer
+from .neighbors import csr_to_knn
+from .reduction import reduce_dims
+from .utils.cache import EmbeddingCache, hash_array
+from .utils.images import ImageList, ImageSource
+from .result import TSNEResult
+from .instrument import NULL_PROFILER
+from .progress import AnytimeMonitor
 
 
-def plot_tsne(output_path, X, uids=None, labels=None, imgs=None,
-              n_clusters=10, n_per_cluster=None, img_alpha=255):
-    """Plots interactive visualization of data using t-SNE clustering
-    and bokeh.
+def _reduce(X, reducer, reduce_kwargs, profiler):
+    """Returns X reduced with `reducer`, or if reducer is None, X itself (as
+    float32 if it is not floating point)"""
+    if reducer is None:
+        return utils.as_float(X)
+    with profiler.stage('reduce', X=X):
+        return reduce_dims(X, method=reducer, **reduce_kwargs)
+
+
+# names of `plot_tsne` keyword arguments passed on to `render_tsne`, all
+# others are passed to `compute_tsne`
+_RENDER_KWARGS = ('img_mode', 'img_level', 'img_zoom_levels', 'img_hover',
+                  'density_bins', 'compact', 'max_bytes')
+
+# size of the plot in screen pixels
+_PLOT_WIDTH, _PLOT_HEIGHT = 1200, 800
+
+# base64 inflates binary data by 4/3
+_B64 = 4. / 3.
+
+
+def _cluster(get_X, digest, reduction, clusterer, n_clusters, cluster_kwargs,
+             random_state, cache, profiler, shared=None):
+    """Returns labels of clustering `get_X()`, cached under the array
+    `digest` of the clustered features. Unless it is the caller's array
+    `shared`, the clusterer may modify `get_X()` in place"""
+    if cache is not None:
+        key = cache.make_key(digest, stage='cluster',
+                             clusterer=embedder_name(clusterer),
+                             cluster_kwargs=cluster_kwargs,
+                             n_clusters=n_clusters, reducer=reduction,
+                             random_state=random_state)
+        hit = cache.get(key)
+        if hit is not None:
+            return hit['labels']
+
+    X_clust = get_X()
+    cluster_fn = get_clusterer(clusterer)
+    if (X_clust is not shared and 'copy_x' not in cluster_kwargs
+            and getattr(cluster_fn, 'supports_copy_x', False)):
+        cluster_kwargs = dict(cluster_kwargs, copy_x=False)
+    with profiler.stage('cluster', X=X_clust):
+        lbls = cluster_fn(X_clust, n_clusters=n_clusters,
+                          random_state=random_state, **cluster_kwargs)
+    if cache is not None:
+        cache.put(key, labels=lbls)
+    return lbls
+
+
+def _sample_and_color(lbls, n_per_cluster, max_points, random_state,
+                      profiler):
+    """Returns (idxs, palette, codes): indexes of the points to draw, and
+    the colors of all points"""
+    # To not overpopulate plot, plot only n data points per cluster label
+    with profiler.stage('sample', labels=lbls):
+        if n_per_cluster is None:
+            idxs = np.arange(len(lbls))
+        else:
+            # get n_per_cluster per unique label in lbls.
+            idxs = utils.sample_n_per_label(lbls, n_per_cluster,
+                                            random_state=random_state)
+        if max_points is not None and len(idxs) > max_points:
+            rng = np.random.RandomState(random_state)
+            idxs = np.sort(rng.choice(idxs, max_points, replace=False))
+
+    # get color code per point + one color per cluster
+    with profiler.stage('color', labels=lbls):
+        palette, codes = colors.get_color_palette(lbls, normed=False)
+    return idxs, palette, codes
+
+
+def _snapshot_fn(on_snapshot, lbls, idxs, palette, codes, uids,
+                 labels_provided):
+    """Returns `f(iteration, xy)` calling `on_snapshot(iteration, result)`
+    with a `TSNEResult` of intermediate coordinates `xy`"""
+    def snapshot(iteration, xy):
+        on_snapshot(iteration, TSNEResult(xy, lbls, idxs, codes, palette,
+                                          uids=uids,
+                                          labels_provided=labels_provided))
+    return snapshot
+
+
+def compute_tsne(X, uids=None, labels=None, n_clusters=10, n_per_cluster=None,
+                 cache=None, embedder='sklearn', embed_kwargs=None,
+                 reducer=None, reduce_kwargs=None, xy=None,
+                 clusterer='kmeans', cluster_kwargs=None,
+                 cluster_on='features', random_state=None, max_points=None,
+                 knn=None, precomputed=False, time_budget=None, kl_tol=None,
+                 snapshot_every=None, on_snapshot=None, profiler=None):
+    """Compute stage of `plot_tsne`: embeds X with t-SNE, clusters it if no
+    labels are given, samples the points to draw and assigns colors.
+
+    Peak memory, for n samples, d features, d' = `n_components` of the
+    `reducer` (or d) and k = 3 * perplexity + 1 neighbors, is about:
+    X itself (nothing resident beyond the page cache for a memmap), plus
+    4 * n * d' bytes of float32 features if X is reduced or not floating
+    point, plus a copy of the clustered features for clusterer='kmeans'
+    on the caller's own X (none with a `reducer` or 'minibatch_kmeans'),
+    plus ~64 * n * k bytes for the neighbor search and affinities of the
+    embedding, which dominate. E.g. 1M x 512 float32 with perplexity=30
+    and reducer='pca': 2 GB (X) + 0.2 GB + ~6 GB.
 
     Parameters
     -------
-    output_path: str
-        Path to save bokeh interaction. Should be extension .html
-
-    X: array, shape (n_samples, n_features) or (n_samples, n_samples)
-        Feature array to apply t-SNE clustering.
+    X: array or scipy.sparse matrix, shape (n_samples, n_features)
+        Feature array to apply t-SNE clustering. May be a read-only
+        np.memmap (see `utils.datasets.load_npy_dataset`); compute_tsne only
+        reads X in chunks and never copies it as a whole. Sparse X (e.g.
+        TF-IDF features) is never densified. If `precomputed`, a sparse
+        matrix of shape (n_samples, n_samples) of distances to nearest
+        neighbors instead.
 
     uids: array, shape (n_samples,), default=None
         Uids associated with rows of X to use as tooltip for hover.
@@ -63,63 +168,557 @@ def plot_tsne(output_path, X, uids=None, labels=None, imgs=None,
     labels: array, shape (n_samples,), default=None
         Class labels or array of integers grouping each row of X
         to 1) color glyphs on scatter plot and 2) for tooltip of hover
-        If None, will automatically compute clusters using KMeans
+        If None, will automatically compute clusters using `clusterer`
         with `n_clusters`
 
-    imgs: array, shape (n_samples, _img_shape_)
-       Images to be plotted with coordinates created from tsne.
-       If None, will use circles (scatter-plot) of bokeh per data.
-
     n_clusters: int, default=10
-        Number of clusters to compute using KMeans, if labels is not
+        Number of clusters to compute using `clusterer`, if labels is not
         provided.
 
     n_per_cluster: int, default=None
         Number of items to plot per cluster. If None, will plot all items
 
+    cache: str or `utils.cache.EmbeddingCache`, default=None
+        If provided, t-SNE coordinates (and KMeans labels, if computed) are
+        stored on disk keyed by the content of X and the parameters used,
+        and reused on subsequent calls with the same X. If a str, will
+        create an `EmbeddingCache` in that directory. Hit/miss counts are
+        available from `cache.stats()`.
+
+    embedder: str or callable, default='sklearn'
+        Engine used to compute the 2-d coordinates. Either a name registered
+        in `embedders.EMBEDDERS` ('sklearn' for scikit-learn's t-SNE, 'fast'
+        for openTSNE's multi-threaded FFT-accelerated t-SNE with approximate
+        nearest neighbors, 'landmark' to embed only a subset of X and place
+        the other rows by interpolation, for X too large for a single fit,
+        see `landmarks.landmark_tsne`), or a function `f(X, **embed_kwargs)`
+        returning an array of shape (n_samples, 2).
+
+    embed_kwargs: dict, default=None
+        Keyword arguments passed to the `embedder`.
+
+    reducer: str, default=None
+        If provided, X is first reduced to fewer dimensions with
+        `reduction.reduce_dims(X, method=reducer, **reduce_kwargs)` (e.g.
+        'pca', 'randomized_pca', 'random_projection' or, for sparse X,
+        'truncated_svd') and the reduced features are used for both the
+        embedding and KMeans. Recommended for wide X (hundreds of features
+        or more).
+
+    reduce_kwargs: dict, default=None
+        Keyword arguments passed to `reduction.reduce_dims`, e.g.
+        {'n_components': 50}.
+
+    xy: array, shape (n_samples, 2), default=None
+        Precomputed coordinates of X, e.g. from a previous call or from
+        `model.EmbeddingModel.transform`. If provided, the embedding stage
+        is skipped.
+
+    clusterer: str or callable, default='kmeans'
+        Engine used to compute labels when `labels` is None. Either a name
+        registered in `clustering.CLUSTERERS` ('kmeans', 'minibatch_kmeans'
+        for streaming KMeans over chunks, 'dbscan' for density-based
+        clustering, best used with `cluster_on='embedding'`), or a function
+        `f(X, n_clusters=, random_state=, **cluster_kwargs)`.
+
+    cluster_kwargs: dict, default=None
+        Keyword arguments passed to the `clusterer`.
+
+    cluster_on: str, default='features'
+        What to cluster: 'features' (X, or the reduced X if `reducer` is
+        set) or 'embedding' (the 2-d t-SNE coordinates, much cheaper).
+
+    random_state: int, default=None
+        Seed for clustering and `n_per_cluster` sampling.
+
+    max_points: int, default=None
+        If provided, at most `max_points` individual glyphs (or images) are
+        drawn, randomly subsampled after `n_per_cluster`.
+
+    knn: tuple (indices, distances), default=None
+        Precomputed nearest neighbors of the (reduced) features, see
+        `neighbors.knn_graph`. Passed on to embedders that support it
+        (`supports_knn`), so several embeddings of the same features only
+        search neighbors once. Not part of the cache key.
+
+    precomputed: bool, default=False
+        Whether X is a sparse (n_samples, n_samples) graph of distances
+        from each sample to its nearest neighbors, e.g. from
+        `sklearn.neighbors.kneighbors_graph(mode='distance')`, in place of
+        features. Its neighbors (see `neighbors.csr_to_knn`) are used for
+        the embedding, which requires an embedder that `supports_knn`, and
+        labels are computed with a clusterer that `supports_precomputed`
+        (e.g. 'dbscan') or on the embedding (`cluster_on='embedding'`).
+
+    time_budget: float, default=None
+        If provided, the t-SNE optimization stops after about this many
+        seconds (including its neighbor search) with the layout reached so
+        far. Checked every `snapshot_every` (or 50) iterations, or at least
+        every 300 with embedder='sklearn' (see `embedders.sklearn_tsne`).
+        Layouts cut short are not cached.
+
+    kl_tol: float, default=None
+        If provided, the t-SNE optimization stops once its KL divergence
+        improves by less than this fraction between checks (see
+        `progress.AnytimeMonitor`).
+
+    snapshot_every: int, default=None
+        With `on_snapshot`, the number of t-SNE iterations between
+        snapshots.
+
+    on_snapshot: callable, default=None
+        If provided with `snapshot_every`, called as `f(iteration, result)`
+        with a `result.TSNEResult` of the layout so far, e.g. to render it.
+        Points are colored by their labels, or all the same if the labels
+        are computed from the embedding.
+
+    profiler: `instrument.Profiler`, default=None
+        If provided, every stage (hash, reduce, embed, cluster, sample,
+        color) runs inside `profiler.stage`, and t-SNE progress is reported
+        to `profiler.on_iteration` (see `instrument.StageProfiler`).
+
+    Returns
+    -------
+    result: `result.TSNEResult`
+        Coordinates, labels, sample indexes & colors, to pass to
+        `render_tsne` or save to disk with `result.save`.
+
+    Raises
+    -------
+    RuntimeError:
+        Error checking for correct shapes of X, uids, labels, etc.
+    """
+    if profiler is None:
+        profiler = NULL_PROFILER
+    n_samples = X.shape[0]
+    for name, arr in (('xy', xy), ('labels', labels), ('uids', uids)):
+        if arr is not None and len(arr) != n_samples:
+            raise RuntimeError("len(%s) != len(X) (%s != %s)"
+                               % (name, len(arr), n_samples))
+    if labels is None and cluster_on not in ('features', 'embedding'):
+        raise RuntimeError("Do not recognize cluster_on = %s" % cluster_on)
+    if precomputed:
+        if reducer is not None:
+            raise RuntimeError("Can't reduce a precomputed graph")
+        if knn is None:
+            knn = csr_to_knn(X)
+
+    if isinstance(cache, str):
+        cache = EmbeddingCache(cache)
+    x_digest = None
+    if cache is not None:
+        with profiler.stage('hash', X=X):
+            x_digest = hash_array(X)
+
+    embed_fn = get_embedder(embedder)
+    if embed_kwargs is None:
+        embed_kwargs = {}
+    if reduce_kwargs is None:
+        reduce_kwargs = {}
+    if cluster_kwargs is None:
+        cluster_kwargs = {}
+
+    # (reduced) features fed to embedding & clustering. Computed lazily so
+    # nothing is done when both stages are cache hits
+    feats = []
+
+    def features():
+        if not feats:
+            feats.append(_reduce(X, reducer, reduce_kwargs, profiler))
+        return feats[0]
+
+    # labels that don't depend on the embedding, and the points to draw, are
+    # settled first so that snapshots of the embedding show them
+    lbls = labels
+    if lbls is None and cluster_on == 'features':
+        if precomputed:
+            if not getattr(get_clusterer(clusterer), 'supports_precomputed',
+                           False):
+                raise RuntimeError("clusterer %s can't cluster a precomputed"
+                                   " graph, use clusterer='dbscan' or "
+                                   "cluster_on='embedding'"
+                                   % embedder_name(clusterer))
+            cluster_kwargs = dict(cluster_kwargs, metric='precomputed')
+        lbls = _cluster(features, x_digest, (reducer, reduce_kwargs),
+                        clusterer, n_clusters, cluster_kwargs, random_state,
+                        cache, profiler, shared=X)
+    if lbls is not None:
+        idxs, palette, codes = _sample_and_color(lbls, n_per_cluster,
+                                                 max_points, random_state,
+                                                 profiler)
+
+    # fit tsne coordinates
+    anytime = (time_budget is not None or kl_tol is not None
+               or (snapshot_every and on_snapshot is not None))
+    if xy is not None:
+        xy = np.asarray(xy)
+    elif cache is not None:
+        key_kwargs = {}
+        if kl_tol is not None:
+            key_kwargs['kl_tol'] = kl_tol
+        tsne_key = cache.make_key(x_digest, stage='tsne',
+                                  embedder=embedder_name(embedder),
+                                  embed_kwargs=embed_kwargs,
+                                  reducer=reducer,
+                                  reduce_kwargs=reduce_kwargs, **key_kwargs)
+        hit = cache.get(tsne_key)
+        if hit is not None:
+            xy = hit['xy']
+    if xy is None:
+        kwargs = dict(embed_kwargs)
+        callback = None
+        if profiler is not NULL_PROFILER:
+            callback = profiler.on_iteration
+        if anytime:
+            if not getattr(embed_fn, 'supports_callback', False):
+                raise RuntimeError("embedder %s doesn't support time_budget, "
+                                   "kl_tol or snapshots"
+                                   % embedder_name(embedder))
+            snapshot = None
+            if snapshot_every and on_snapshot is not None:
+                if lbls is not None:
+                    snap = (lbls, idxs, palette, codes)
+                else:
+                    # not clustered yet, so all points get the same color
+                    snap_lbls = np.zeros(n_samples, dtype=np.int32)
+                    snap = (snap_lbls,) + _sample_and_color(
+                        snap_lbls, None, max_points, random_state,
+                        NULL_PROFILER)
+                snapshot = _snapshot_fn(on_snapshot, *snap, uids=uids,
+                                        labels_provided=labels is not None)
+            callback = AnytimeMonitor(time_budget=time_budget, kl_tol=kl_tol,
+                                      snapshot_every=snapshot_every,
+                                      on_snapshot=snapshot,
+                                      callback=callback)
+            kwargs.setdefault('callback_every', snapshot_every or 50)
+        if (callback is not None
+                and getattr(embed_fn, 'supports_callback', False)):
+            kwargs['callback'] = callback
+        if knn is not None and getattr(embed_fn, 'supports_knn', False):
+            kwargs['knn'] = knn
+        elif precomputed:
+            raise RuntimeError("embedder %s can't embed a precomputed graph"
+                               % embedder_name(embedder))
+        X_feat = None if precomputed else features()
+        with profiler.stage('embed', X=X_feat):
+            # the neighbors are all embedders need from a precomputed graph
+            xy = embed_fn(X_feat, **kwargs)
+        # layouts cut short by the time budget are not reproducible
+        if cache is not None and getattr(callback, 'stop_reason',
+                                         None) != 'time_budget':
+            cache.put(tsne_key, xy=xy)
+
+    # if no label is provided, color by clustering the embedding
+    if lbls is None:
+        digest = hash_array(xy) if cache is not None else None
+        lbls = _cluster(lambda: xy, digest, None, clusterer, n_clusters,
+                        cluster_kwargs, random_state, cache, profiler,
+                        shared=xy)
+        idxs, palette, codes = _sample_and_color(lbls, n_per_cluster,
+                                                 max_points, random_state,
+                                                 profiler)
+
+    return TSNEResult(xy, lbls, idxs, codes, palette, uids=uids,
+                      labels_provided=labels is not None)
+
+
+def _check_imgs(imgs, n_samples):
+    """Returns (imgs, H, W) after checking `imgs` matches the number of
+    samples and has a usable image shape"""
+    # lists of images are only stacked for the rows drawn
+    if isinstance(imgs, (list, tuple)):
+        imgs = ImageList(imgs)
+    elif not isinstance(imgs, (ImageSource, ImageList)):
+        imgs = np.asarray(imgs)  # make sure its numpy array for ease use
+    # check if imgs correspond to X by size
+    if len(imgs) != n_samples:
+        raise RuntimeError("len(imgs) != len(X) (%s != %s)"
+                           % (len(imgs), n_samples))
+
+    # get image shapes to convert to img object for bokeh to absorb
+    shape = imgs.shape[1:]
+    # greyscale
+    if len(shape) == 2:
+        H, W = shape
+    elif len(shape) == 3:
+        H, W, C = shape
+    else:
+        raise RuntimeError("Can't get correct image shape from first"
+                           " image of the dataset. Got shape = %s" % (shape,))
+    return imgs, H, W
+
+
+def _img_scale(H, W):
+    """Factor t-SNE coordinates are scaled by so images of H x W don't
+    overlap too much"""
+    return np.max([H, W]) / 5.0
+
+
+def _pyramid_factor(H, W, dh, dw, x_span, y_span):
+    """Largest power of two images of H x W pixels can be downsampled by
+    while keeping at least one pixel per screen pixel, when drawn dw x dh
+    data units large on a plot showing x_span x y_span data units"""
+    if x_span <= 0 or y_span <= 0:
+        return 1
+    screen_w = dw * _PLOT_WIDTH / float(x_span)
+    screen_h = dh * _PLOT_HEIGHT / float(y_span)
+    factor = 1
+    while (2 * factor <= min(H, W)
+           and -(-W // (2 * factor)) >= screen_w
+           and -(-H // (2 * factor)) >= screen_h):
+        factor *= 2
+    return factor
+
+
+def _pyramid_factors(img_level, img_zoom_levels, H, W, dh, dw, x_span,
+                     y_span):
+    """Downsampling factors of the image levels to draw, coarsest first"""
+    if img_level == 'auto':
+        img_level = _pyramid_factor(H, W, dh, dw, x_span, y_span)
+    elif not isinstance(img_level, (int, np.integer)) or img_level < 1:
+        raise RuntimeError("img_level must be 'auto' or a positive int, got "
+                           "%s" % (img_level,))
+    factors = [img_level]
+    for _ in range(img_zoom_levels):
+        if factors[-1] == 1:
+            break
+        factors.append(max(1, factors[-1] // 2))
+    return factors
+
+
+def _draw_rgba(p, imgs, x, y, dw, dh, compact):
+    """Draws RGBA uint8 images of shape (H, W, 4) with bottom-left origin
+    and bottom-left corners at `x`, `y`, using a single renderer, which is
+    returned. If `compact`, images are shipped as PNG instead of raw
+    pixels"""
+    if compact:
+        urls = [bokeh_utils.png_data_uri(img[::-1]) for img in imgs]
+        return p.image_url(url=urls, x=list(x), y=list(y), w=list(dw),
+                           h=list(dh), anchor='bottom_left')
+    bimgs = [np.ascontiguousarray(img).view(np.uint32)[..., 0]
+             for img in imgs]
+    return p.image_rgba(image=bimgs, x=list(x), y=list(y), dw=list(dw),
+                        dh=list(dh))
+
+
+def _draw_imgs(p, rgba, x0, y0, bw, bh, img_mode, compact, profiler):
+    """Draws RGBA images `rgba` of shape (N, H, W, 4) as `img_mode` with
+    bottom-left corners at `x0`, `y0`. Returns the renderer"""
+    if img_mode == 'atlas':
+        with profiler.stage('atlas', imgs=rgba):
+            tiles = bokeh_utils.compose_atlas(rgba, x0, y0, bw, bh)
+        return _draw_rgba(p, [t['image'].view(np.uint8).reshape(
+                                 t['image'].shape + (4,)) for t in tiles],
+                          [t['x'] for t in tiles], [t['y'] for t in tiles],
+                          [t['dw'] for t in tiles],
+                          [t['dh'] for t in tiles], compact)
+    return _draw_rgba(p, rgba, x0, y0, [bw] * len(rgba), [bh] * len(rgba),
+                      compact)
+
+
+def _switch_on_zoom(p, renderers, factors):
+    """Shows only the renderer of images downsampled by `factors` (coarsest
+    first) that matches the current zoom of the plot. The coarsest level is
+    also shown when zoomed out past the initial view"""
+    import bokeh.models as bkm
+
+    for r in renderers[1:]:
+        r.visible = False
+    x_span = p.x_range.end - p.x_range.start
+    zooms = [factors[0] / float(f) for f in factors]
+    switch = bkm.CustomJS(args=dict(renderers=renderers, zooms=zooms,
+                                    span=x_span), code="""
+        var zoom = span / (cb_obj.end - cb_obj.start);
+        for (var i = 0; i < renderers.length; i++) {
+            renderers[i].visible = (i == 0 || zoom >= zooms[i]) &&
+                (i + 1 == renderers.length || zoom < zooms[i + 1]);
+        }
+    """)
+    p.x_range.js_on_change('start', switch)
+    p.x_range.js_on_change('end', switch)
+
+
+def _img_bytes(img, compact):
+    """Returns the shipped size of an RGBA uint8 image of shape (H, W, 4):
+    as a PNG data URI if `compact`, else as base64 raw pixels"""
+    if compact:
+        return len(bokeh_utils.png_data_uri(img))
+    return img.nbytes * _B64
+
+
+def _atlas_bytes(rgba, x0, y0, bw, bh, factors, compact):
+    """Returns the shipped size of the atlas tiles of every level of the
+    image pyramid of `rgba`, placed as `_draw_imgs` places them"""
+    n_bytes = 0
+    for level in bokeh_utils.image_pyramid(rgba, factors).values():
+        for t in bokeh_utils.compose_atlas(level, x0, y0, bw, bh):
+            img = t['image']
+            n_bytes += _img_bytes(img.view(np.uint8).reshape(
+                img.shape + (4,)), compact)
+    return n_bytes
+
+
+def _fit_budget(result, idxs, imgs, img_alpha, max_bytes, fixed_bytes,
+                factors=(1,), img_hover=False, compact=False,
+                img_mode='glyph', placement=None, random_state=0):
+    """Returns subset of `idxs` such that the estimated size of the shipped
+    per-point data (and thumbnails, downsampled by `factors`, plus the
+    full resolution ones if `img_hover`) plus `fixed_bytes` fits
+    `max_bytes`. With img_mode='atlas', `placement` is (scale, bw, bh) of
+    the images and the composed tiles of a candidate subset are measured,
+    shrinking it until they fit"""
+    # coordinates are shipped as float32 only if compact
+    per_point = 2 * (4 if compact else 8) + result.codes.dtype.itemsize
+    for arr in (result.uids, result.labels if result.labels_provided
+                else None):
+        if arr is None:
+            continue
+        if arr.dtype.kind in 'iub':
+            per_point += arr.dtype.itemsize
+        else:
+            per_point += 4 + np.mean([len(str(v)) for v in arr[idxs[:100]]])
+    per_point *= _B64
+
+    atlas = imgs is not None and img_mode == 'atlas'
+    if imgs is not None and len(idxs):
+        sample = bokeh_utils.preproc_imgs(imgs[idxs[:32]], alpha=img_alpha)
+        rgba = sample.view(np.uint8).reshape(sample.shape + (4,))
+        # atlas tiles are measured below, as they don't scale per image
+        levels = [] if atlas else [
+            (level, compact) for level in
+            bokeh_utils.image_pyramid(rgba, factors).values()]
+        if img_hover:
+            # hover thumbnails are always shipped as PNG
+            levels.append((rgba, True))
+        for level, png in levels:
+            per_point += np.mean([_img_bytes(img, png) for img in level])
+
+    budget = max(0, max_bytes - fixed_bytes)
+    n_fit = int(budget // per_point)
+    if n_fit >= len(idxs) and not atlas:
+        return idxs
+    order = np.random.RandomState(random_state).permutation(len(idxs))
+    n_fit = max(min(n_fit, len(idxs)), 1)
+    while atlas:
+        sub = np.sort(idxs[order[:n_fit]])
+        bimgs = bokeh_utils.preproc_imgs(imgs[sub], alpha=img_alpha)
+        scale, bw, bh = placement
+        total = n_fit * per_point + _atlas_bytes(
+            bimgs.view(np.uint8).reshape(bimgs.shape + (4,)),
+            result.xy[sub, 0] * scale - bw / 2.,
+            result.xy[sub, 1] * scale - bh / 2., bw, bh, factors, compact)
+        if total <= budget or n_fit == 1:
+            return sub
+        n_fit = max(1, min(n_fit - 1, int(n_fit * 0.9 * budget / total)))
+    return np.sort(idxs[order[:n_fit]])
+
+
+def render_tsne(output_path, result, imgs=None, img_alpha=255,
+                img_mode='glyph', img_level='auto', img_zoom_levels=0,
+                img_hover=False, density_bins=None, compact=False,
+                max_bytes=None, profiler=None):
+    """Render stage of `plot_tsne`: draws a `result.TSNEResult` with bokeh
+    and saves it to `output_path`. Cheap compared to `compute_tsne`, so many
+    variants can be rendered from one result.
+
+    Parameters
+    -------
+    output_path: str
+        Path to save bokeh interaction. Should be extension .html
+
+    result: `result.TSNEResult`
+        Output of `compute_tsne` (or `TSNEResult.load`).
+
+    imgs: array, shape (n_samples, _img_shape_) or `utils.images.ImageSource`
+       Images to be plotted with coordinates created from tsne.
+       If None, will use circles (scatter-plot) of bokeh per data.
+       If an `ImageSource`, only the images that are drawn (see
+       `n_per_cluster`) are loaded.
+
     img_alpha: int, default=255
         If `imgs` is provided, will plot imgs with a transparency given by
         img_alpha. `img_alpha` must be in the range [0, 255], where 0 is
         completely transparent, and 255 is opaque.
 
+    img_mode: str, default='glyph'
+        How `imgs` are drawn. 'glyph' draws every image as its own item of
+        a single `image_rgba` renderer. 'atlas' first composes all images
+        into a few large tiles (see `bokeh_utils.compose_atlas`), which
+        keeps the output small and fast to render for many thousands of
+        images, at the cost of images no longer being drawn separately.
+
+    img_level: str or int, default='auto'
+        Factor `imgs` are downsampled by (with a box filter, see
+        `bokeh_utils.downsample_imgs`) before they are drawn. 'auto' picks
+        the largest power of two that still leaves at least one image pixel
+        per screen pixel at the initial zoom, so thumbnails much larger than
+        they appear on screen are not shipped at full resolution. 1 draws
+        them at full resolution. The size of the shipped images drops with
+        the square of the factor.
+
+    img_zoom_levels: int, default=0
+        Number of finer levels of the image pyramid (each downsampled half
+        as much as the previous, down to full resolution) also shipped, and
+        shown instead when zooming in far enough for them to be sharper.
+        Each level costs about 4 times as much as the previous.
+
+    img_hover: bool, default=False
+        Whether hovering an image shows it at full resolution (shipped as
+        PNG) in the tooltip.
+
+    density_bins: int, default=None
+        If provided, all points are rasterized server-side into a single
+        density image of `density_bins` x `density_bins` pixels, colored by
+        label (see `bokeh_utils.rasterize_density`), drawn beneath the
+        hoverable glyphs. Use with `n_per_cluster` or `max_points` to only
+        ship a subset of individual glyphs for very large datasets.
+
+    compact: bool, default=False
+        Whether to minimize the size of the saved file: coordinates are
+        shipped as float32 and color codes, integer uids & labels with the
+        smallest integer dtype (all as binary arrays), other uids & labels
+        that repeat as integer codes into a table of their unique values,
+        and images & the density raster as PNG instead of raw RGBA pixels.
+
+    max_bytes: int, default=None
+        Approximate budget for the size of the data in the saved file. If
+        the points (and their images) to draw are estimated to exceed it,
+        a random subset of them that fits is drawn instead. The estimate
+        follows `compact` and `img_mode`: with img_mode='atlas', the
+        composed tiles of the subset are measured.
+
+    profiler: `instrument.Profiler`, default=None
+        If provided, every stage (density, preproc_imgs, pyramid, atlas,
+        save) runs inside `profiler.stage` (see `instrument.StageProfiler`).
+
     Returns
     -------
-    xy, ndarray of shape (n_samples, 2)
-        x & y coordinates output from t-sne collapsing of X features.
+    p: bokeh figure
+        The saved figure.
 
     Raises
     -------
     RuntimeError:
-        Error checking for correct shapes of X, uids, labels, imgs, etc.
-
-    Examples
-    -------
-    See `itsne/examples` for usage.
+        Error checking for correct shapes of imgs, etc.
     """
-    # fit tsne coordinates
-    xy = TSNE().fit_transform(X)
+    # bokeh is only imported by the stage that needs it
+    import bokeh.plotting as bkp
+    import bokeh.models as bkm
+
+    if img_mode not in ('glyph', 'atlas'):
+        raise RuntimeError("Do not recognize img_mode = %s" % img_mode)
+    if profiler is None:
+        profiler = NULL_PROFILER
+
+    xy, idxs, codes, palette = (result.xy, result.idxs, result.codes,
+                                result.palette)
 
     # get H, W from image by loading first image of the set, if provided
     if imgs is not None:
-        imgs = np.array(imgs)  # make sure its numpy array for ease use
-        # check if imgs correspond to X by size
-        if len(imgs) != len(X):
-            raise RuntimeError("len(imgs) != len(X) (%s != %s)"
-                               % (len(imgs), len(X)))
-
-        # get image shapes to convert to img object for bokeh to absorb
-        shape = imgs[0].shape
-        # greyscale
-        if len(shape) == 2:
-            H, W = shape
-        elif len(shape) == 3:
-            H, W, C = shape
-        else:
-            raise RuntimeError("Can't get correct image shape from first"
-                               " image of the dataset. Got shape = %s" % shape)
+        imgs, H, W = _check_imgs(imgs, len(xy))
         bh, bw = (H / 2, W / 2)
-        scale = np.max([H, W]) / 5.0
-        xy = xy * scale
+        # only the coordinates drawn are scaled, rather than copying all
+        scale = _img_scale(H, W)
 
         # plot glyphs for hover but not to show
         glyph_kwargs = {'alpha': 0.0, 'size': int(np.min([H, W]))}
@@ -127,72 +726,237 @@ def plot_tsne(output_path, X, uids=None, labels=None, imgs=None,
         # no images provided, so lets show circle glyphs with hover
         glyph_kwargs = {'fill_alpha': 0.35, 'line_alpha': 0.9,
                         'line_width': 2, 'size': 12}
+        scale = 1.
 
-    # if no label is provided, color by KMeans clustering algorithm
-    if labels is None:
-        lbls = KMeans(n_clusters=n_clusters).fit_predict(X)
-    else:
-        if len(labels) != len(X):
-            raise RuntimeError("len(labels) != len(X) (%s != %s)"
-                               % (len(labels), len(X)))
-        lbls = labels
+    if density_bins is not None:
+        with profiler.stage('density', xy=xy):
+            raster = bokeh_utils.rasterize_density(
+                xy[:, 0], xy[:, 1], codes, palette, bins=density_bins)
+        for k in ('x', 'y', 'dw', 'dh'):
+            raster[k] *= scale
 
-    # To not overpopulate plot, plot only n data points per cluster label
-    if n_per_cluster is None:
-        idxs = np.arange(len(lbls))
-    else:
-        # get n_per_cluster per unique label in lbls.
-        idxs = utils.sample_n_per_label(lbls, n_per_cluster)
+    # levels of the image pyramid to draw, chosen by on-screen image size
+    if imgs is not None:
+        shown = xy if density_bins is not None else xy[idxs]
+        factors = _pyramid_factors(img_level, img_zoom_levels, H, W, bh, bw,
+                                   np.ptp(shown[:, 0]) * scale,
+                                   np.ptp(shown[:, 1]) * scale)
+
+    if max_bytes is not None:
+        fixed = 0
+        if density_bins is not None:
+            fixed = raster['image'].nbytes * (0.5 if compact else _B64)
+        idxs = _fit_budget(result, idxs, imgs, img_alpha, max_bytes, fixed,
+                           factors=factors if imgs is not None else (1,),
+                           img_hover=img_hover, compact=compact,
+                           img_mode=img_mode,
+                           placement=(scale, bw, bh) if imgs is not None
+                           else None)
 
     # get xy coordinates and prepare data for bokeh
-    x = xy[idxs, 0]
-    y = xy[idxs, 1]
+    x = xy[idxs, 0] * scale
+    y = xy[idxs, 1] * scale
+    if compact:
+        x, y = x.astype(np.float32), y.astype(np.float32)
 
     data = dict(x=x, y=y)
     hover_tt = []  # hover tool
     # fill dict and hover tool tip with uids & labels
-    if uids is not None:
-        if len(uids) != len(X):
-            raise RuntimeError("len(uids) != len(X) (%s != %s)"
-                               % (len(uids), len(X)))
-
-        uids = uids[idxs]
-        data['uids'] = uids
+    if result.uids is not None:
+        data['uids'] = result.uids[idxs]
         hover_tt.append(('uid', '@uids'))
 
-    if labels is not None:
-        lbls = lbls[idxs]
-        data['labels'] = lbls
+    if result.labels_provided:
+        data['labels'] = result.labels[idxs]
         hover_tt.append(('label', '@labels'))
 
-    # get color array per cluster
-    c_arr = colors.get_color_arr(lbls, normed=False)
-    hex_arr = colors.rgb_to_hex(c_arr)
+    # color codes are mapped to the palette client side, so no per-point
+    # color strings are shipped
+    data['color'] = codes[idxs]
+    formatters = {}
+    if compact:
+        # repeated non-integer uids & labels are shipped as codes into a
+        # table of their unique values, looked up by the tooltip
+        for k in ('uids', 'labels'):
+            if k not in data or data[k].dtype.kind in 'iub':
+                continue
+            table, inverse = np.unique(data[k], return_inverse=True)
+            if len(table) < len(data[k]):
+                data[k] = inverse
+                formatters['@' + k] = bkm.CustomJSHover(
+                    args=dict(table=table.tolist()),
+                    code="return String(table[value]);")
+        hover_tt = [(name, field + '{custom}' if field in formatters
+                     else field) for name, field in hover_tt]
+        for k in ('uids', 'labels', 'color'):
+            if k in data and data[k].dtype.kind in 'iu':
+                data[k] = bokeh_utils.smallest_int_dtype(data[k])
+    mapper = bkm.LinearColorMapper(palette=list(colors.rgb_to_hex(palette)),
+                                   low=-0.5, high=len(palette) - 0.5)
+    cmap = {'field': 'color', 'transform': mapper}
+
+    # get axis limits, of all points if they are all drawn as density
+    if density_bins is not None:
+        min_x, max_x = np.min(xy[:, 0]) * scale, np.max(xy[:, 0]) * scale
+        min_y, max_y = np.min(xy[:, 1]) * scale, np.max(xy[:, 1]) * scale
+    else:
+        min_x, max_x = np.min(x), np.max(y)
+        min_y, max_y = np.min(y), np.max(y)
 
-    # get axis limits
-    min_x, max_x = np.min(x), np.max(y)
-    min_y, max_y = np.min(y), np.max(y)
+    if imgs is not None:
+        # only the drawn images are loaded if imgs is an ImageSource
+        with profiler.stage('preproc_imgs', idxs=idxs):
+            bimgs = bokeh_utils.preproc_imgs(imgs[idxs], alpha=img_alpha)
+        rgba = bimgs.view(np.uint8).reshape(bimgs.shape + (4,))
+        if img_hover:
+            # full resolution, back to top-left origin for html
+            data['img'] = [bokeh_utils.png_data_uri(img[::-1])
+                           for img in rgba]
+            hover_tt = ('<div><img src="@img" width="%i" height="%i"></div>'
+                        % (W, H)) + ''.join('<div>%s: %s</div>' % tt
+                                             for tt in hover_tt)
 
     # finally, start plotting in bokeh
     bkp.output_file(output_path)
-    p = bkp.figure(plot_width=1200, plot_height=800,
+    p = bkp.figure(plot_width=_PLOT_WIDTH, plot_height=_PLOT_HEIGHT,
                    x_range=[min_x - np.abs(0.10 * min_x), max_x + .10 * max_x],
                    y_range=[min_y - np.abs(0.10 * min_y), max_x + .10 * max_y])
 
+    if density_bins is not None:
+        img = raster['image']
+        _draw_rgba(p, [img.view(np.uint8).reshape(img.shape + (4,))],
+                   [raster['x']], [raster['y']], [raster['dw']],
+                   [raster['dh']], compact)
+
     source = bkp.ColumnDataSource(data=data)
-    hover = bkm.HoverTool(tooltips=hover_tt)
-    p.circle('x', 'y', source=source, fill_color=hex_arr, line_color=hex_arr,
+    hover = bkm.HoverTool(tooltips=hover_tt, formatters=formatters)
+    p.circle('x', 'y', source=source, fill_color=cmap, line_color=cmap,
              **glyph_kwargs)
     p.add_tools(hover)
 
     # if images provided, plot them on x&y coordinates instead of circle glyphs
     if imgs is not None:
-        # Can't find any documentation on plotting an array of images for now..
-        for i, img in enumerate(imgs[idxs]):
-            bimg = bokeh_utils.preproc_img(img, alpha=img_alpha)
-            p.image_rgba(image=[bimg], x=[x[i] - (bw / 2)],
-                         y=[y[i] - (bh / 2)], dw=[bw], dh=[bh])
+        x0, y0 = x - (bw / 2), y - (bh / 2)
+        with profiler.stage('pyramid', imgs=rgba):
+            levels = bokeh_utils.image_pyramid(rgba, factors)
+        renderers = [_draw_imgs(p, levels[f], x0, y0, bw, bh, img_mode,
+                                compact, profiler) for f in factors]
+        if len(renderers) > 1:
+            _switch_on_zoom(p, renderers, factors)
 
     # save bokeh plot
-    bkp.save(p)
+    with profiler.stage('save'):
+        bkp.save(p)
+    return p
+
+
+def _snapshot_writer(path, imgs, img_alpha, render_kwargs):
+    """Returns `on_snapshot` function of `plot_tsne(..., snapshot_path=)`"""
+    def write(iteration, result):
+        out = path % iteration if '%' in path else path
+        if out.endswith('.npz'):
+            result.save(out)
+        else:
+            render_tsne(out, result, imgs=imgs, img_alpha=img_alpha,
+                        **render_kwargs)
+    return write
+
+
+def plot_tsne(output_path, X, uids=None, labels=None, imgs=None,
+              n_clusters=10, n_per_cluster=None, img_alpha=255, **kwargs):
+    """Plots interactive visualization of data using t-SNE clustering
+    and bokeh. Same as `render_tsne(output_path, compute_tsne(X, ...), ...)`.
+
+    Parameters
+    -------
+    output_path: str
+        Path to save bokeh interaction. Should be extension .html
+
+    X: array or scipy.sparse matrix, shape (n_samples, n_features)
+        Feature array to apply t-SNE clustering. May be a read-only
+        np.memmap (see `utils.datasets.load_npy_dataset`) or sparse; see
+        `compute_tsne`. With `precomputed=True`, a sparse (n_samples,
+        n_samples) nearest neighbor distance graph instead.
+
+    uids: array, shape (n_samples,), default=None
+        Uids associated with rows of X to use as tooltip for hover.
+        If None, will not use for tooltip or anything.
+
+    labels: array, shape (n_samples,), default=None
+        Class labels or array of integers grouping each row of X
+        to 1) color glyphs on scatter plot and 2) for tooltip of hover
+        If None, will automatically compute clusters using `clusterer`
+        with `n_clusters`
+
+    imgs: array, shape (n_samples, _img_shape_) or `utils.images.ImageSource`
+       Images to be plotted with coordinates created from tsne.
+       If None, will use circles (scatter-plot) of bokeh per data.
+       If an `ImageSource`, only the images that are drawn (see
+       `n_per_cluster`) are loaded.
+
+    n_clusters: int, default=10
+        Number of clusters to compute using `clusterer`, if labels is not
+        provided.
+
+    n_per_cluster: int, default=None
+        Number of items to plot per cluster. If None, will plot all items
+
+    img_alpha: int, default=255
+        If `imgs` is provided, will plot imgs with a transparency given by
+        img_alpha. `img_alpha` must be in the range [0, 255], where 0 is
+        completely transparent, and 255 is opaque.
+
+    kwargs:
+        Keyword arguments `img_mode`, `img_level`, `img_zoom_levels`,
+        `img_hover`, `density_bins`, `compact` & `max_bytes` are passed to
+        `render_tsne`, `profiler` to both, and
+        all others (`cache`, `embedder`, `embed_kwargs`, `reducer`,
+        `reduce_kwargs`, `xy`, `clusterer`, `cluster_kwargs`, `cluster_on`,
+        `random_state`, `max_points`, `knn`, `precomputed`, `time_budget`,
+        `kl_tol`, `snapshot_every`, `on_snapshot`) to `compute_tsne`.
+
+        In addition, `snapshot_path` writes a snapshot of the layout every
+        `snapshot_every` (default 300) t-SNE iterations: rendered like the
+        final plot, or saved as a `result.TSNEResult` if it ends with .npz.
+        It may contain a %i for the iteration, otherwise each snapshot
+        overwrites the previous one.
+
+    Returns
+    -------
+    xy, ndarray of shape (n_samples, 2)
+        x & y coordinates output from t-sne collapsing of X features.
+
+    Raises
+    -------
+    RuntimeError:
+        Error checking for correct shapes of X, uids, labels, imgs, etc.
+
+    Examples
+    -------
+    See `itsne/examples` for usage.
+    """
+    render_kwargs = dict((k, kwargs.pop(k)) for k in _RENDER_KWARGS
+                         if k in kwargs)
+    if imgs is not None:
+        imgs, H, W = _check_imgs(imgs, X.shape[0])
+    snapshot_path = kwargs.pop('snapshot_path', None)
+    if snapshot_path is not None:
+        kwargs.setdefault('snapshot_every', 300)
+        kwargs['on_snapshot'] = _snapshot_writer(snapshot_path, imgs,
+                                                 img_alpha,
+                                                 dict(render_kwargs))
+    render_kwargs['profiler'] = kwargs.get('profiler')
+
+    result = compute_tsne(X, uids=uids, labels=labels, n_clusters=n_clusters,
+                          n_per_cluster=n_per_cluster, **kwargs)
+    render_tsne(output_path, result, imgs=imgs, img_alpha=img_alpha,
+                **render_kwargs)
+
+    xy = result.xy
+    if imgs is not None:
+        # scale in place, unless xy is the caller's
+        if kwargs.get('xy') is None and xy.flags.writeable:
+            xy *= _img_scale(H, W)
+        else:
+            xy = xy * _img_scale(H, W)
     return xy
@@ -0,0 +1,241 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Landmark t-SNE, for datasets too large to embed in a single fit.
+
+A representative subset of the rows (the landmarks) is embedded with a
+regular embedder, then every other row is placed at the affinity-weighted
+position of its nearest landmarks (see `model.EmbeddingModel.transform`),
+streamed in chunks so X may be a memmap larger than memory. The cost is that
+of embedding the landmarks plus a pass over X linear in its number of rows.
+
+`landmark_tsne` is registered as embedder 'landmark':
+
+    itsne.plot_tsne('map.html', X, embedder='landmark',
+                    embed_kwargs={'n_landmarks': 50000, 'embedder': 'fast'})
+"""
+import numpy as np
+
+# local imports
+from .clustering import fit_minibatch_kmeans
+from .embedders import get_embedder, register_embedder
+from .model import EmbeddingModel
+from .utils.utils import as_float, issparse, read_rows
+
+
+def _random_landmarks(X, n_landmarks, rng, chunk_size):
+    return rng.choice(X.shape[0], n_landmarks, replace=False)
+
+
+def _kmeans_landmarks(X, n_landmarks, rng, chunk_size):
+    """Rows closest to the centroids of a streaming KMeans"""
+    from sklearn.neighbors import NearestNeighbors
+
+    model = fit_minibatch_kmeans(X, n_clusters=n_landmarks,
+                                 random_state=rng.randint(2 ** 31 - 1),
+                                 chunk_size=chunk_size, n_epochs=1,
+                                 n_init=1)
+    nn = NearestNeighbors(n_neighbors=1).fit(model.cluster_centers_)
+    best_dist = np.full(n_landmarks, np.inf)
+    best_row = np.full(n_landmarks, -1, dtype=np.int64)
+    for start in range(0, X.shape[0], chunk_size):
+        rows = as_float(read_rows(X, start, start + chunk_size))
+        dists, centers = nn.kneighbors(rows)
+        dists, centers = dists[:, 0], centers[:, 0]
+        # closest row of this chunk to each of its centroids
+        order = np.lexsort((dists, centers))
+        centers, first = np.unique(centers[order], return_index=True)
+        rows = order[first]
+        closer = dists[rows] < best_dist[centers]
+        best_dist[centers[closer]] = dists[rows[closer]]
+        best_row[centers[closer]] = rows[closer] + start
+    # centroids no row is closest to have no landmark
+    return best_row[best_row >= 0]
+
+
+def _coreset_landmarks(X, n_landmarks, rng, chunk_size):
+    """Lightweight coreset (Bachem et al., 2018): rows sampled with
+    probability half uniform, half proportional to their squared distance
+    to the mean, without replacement"""
+    n_samples = X.shape[0]
+    mean = np.zeros(X.shape[1])
+    for start in range(0, n_samples, chunk_size):
+        rows = as_float(read_rows(X, start, start + chunk_size))
+        mean += np.asarray(rows.sum(axis=0), dtype=np.float64).ravel()
+    mean /= n_samples
+
+    sq_dists = np.empty(n_samples)
+    for start in range(0, n_samples, chunk_size):
+        rows = as_float(read_rows(X, start, start + chunk_size))
+        if issparse(rows):
+            sq = (np.asarray(rows.multiply(rows).sum(axis=1)).ravel()
+                  - 2. * rows.dot(mean) + mean.dot(mean))
+        else:
+            sq = np.sum((rows - mean) ** 2, axis=1)
+        sq_dists[start:start + chunk_size] = np.maximum(sq, 0.)
+
+    weights = .5 / n_samples + .5 * sq_dists / max(sq_dists.sum(), 1e-12)
+    # weighted sampling without replacement (Efraimidis & Spirakis, 2006):
+    # the rows with the largest u ** (1 / weight)
+    keys = np.log(rng.uniform(size=n_samples)) / weights
+    return np.argpartition(-keys, n_landmarks - 1)[:n_landmarks]
+
+
+LANDMARK_METHODS = {'random': _random_landmarks,
+                    'kmeans': _kmeans_landmarks,
+                    'coreset': _coreset_landmarks}
+
+
+def select_landmarks(X, n_landmarks, method='random', random_state=None,
+                     chunk_size=10000):
+    """Returns sorted indexes of about `n_landmarks` representative rows of
+    X.
+
+    Parameters
+    ------
+    X: array or scipy.sparse matrix, shape (n_samples, n_features)
+        Features to choose from. Only read `chunk_size` rows at a time.
+
+    n_landmarks: int
+        Number of rows to choose. 'kmeans' may return a few less.
+
+    method: str, default='random'
+        'random' for a uniform sample, 'kmeans' for the rows closest to the
+        centroids of a streaming KMeans with `n_landmarks` clusters (covers
+        small clusters best, but costs a KMeans fit), or 'coreset' for a
+        lightweight coreset, favoring rows far from the mean.
+
+    random_state: int, default=None
+        Seed of the selection.
+
+    chunk_size: int, default=10000
+        Number of rows of X read at a time.
+    """
+    if method not in LANDMARK_METHODS:
+        raise RuntimeError("Do not recognize landmark method = %s. Choose one"
+                           " of %s" % (method, sorted(LANDMARK_METHODS)))
+    n_landmarks = min(n_landmarks, X.shape[0])
+    rng = np.random.RandomState(random_state)
+    return np.sort(LANDMARK_METHODS[method](X, n_landmarks, rng, chunk_size))
+
+
+def _without_xy(callback):
+    """Reports progress of the landmark fit without its coordinates, which
+    don't cover all rows"""
+    def report(iteration, kl_divergence, xy=None):
+        return callback(iteration, kl_divergence, None)
+    return report
+
+
+def landmark_tsne(X, n_landmarks=10000, landmarks='random',
+                  embedder='sklearn', n_neighbors=15, n_refine=0,
+                  chunk_size=10000, n_jobs=1, random_state=None,
+                  callback=None, **kwargs):
+    """Embeds `n_landmarks` rows of X with `embedder`, then places all other
+    rows by kNN interpolation between the landmarks.
+
+    Parameters
+    ------
+    X: array or scipy.sparse matrix, shape (n_samples, n_features)
+        Features to embed. Only the landmarks are held in memory at once.
+
+    n_landmarks: int, default=10000
+        Number of rows embedded with `embedder`. If X has no more rows, X is
+        embedded directly.
+
+    landmarks: str, default='random'
+        How landmarks are chosen, see `select_landmarks`.
+
+    embedder: str or callable, default='sklearn'
+        Engine embedding the landmarks, see `embedders.get_embedder`.
+
+    n_neighbors: int, default=15
+        Number of nearest landmarks each row is placed between.
+
+    n_refine: int, default=0
+        Number of optimization steps refining the position of each placed
+        row against the frozen landmarks (see
+        `model.EmbeddingModel.transform`). Each costs about as much as the
+        placement itself.
+
+    chunk_size: int, default=10000
+        Number of rows read and placed at a time.
+
+    n_jobs: int, default=1
+        Number of chunks placed in parallel threads, or all cpus if -1.
+
+    random_state: int, default=None
+        Seed of the landmark selection, embedding and refinement.
+
+    callback: callable, default=None
+        Passed on to `embedder` if it `supports_callback`, so the landmark
+        fit can be stopped early. It is called without coordinates, so no
+        snapshots are taken.
+
+    kwargs:
+        Passed on to `embedder`, e.g. `perplexity`.
+
+    Returns
+    ------
+    xy: ndarray of shape (n_samples, n_components)
+    """
+    embed_fn = get_embedder(embedder)
+    if random_state is not None:
+        kwargs.setdefault('random_state', random_state)
+    if callback is not None and getattr(embed_fn, 'supports_callback',
+                                        False):
+        kwargs['callback'] = _without_xy(callback)
+    else:
+        kwargs.pop('callback_every', None)
+
+    n_samples = X.shape[0]
+    if n_samples <= n_landmarks:
+        return embed_fn(as_float(X), **kwargs)
+
+    idxs = select_landmarks(X, n_landmarks, method=landmarks,
+                            random_state=random_state, chunk_size=chunk_size)
+    X_land = as_float(X[idxs])
+    xy_land = embed_fn(X_land, **kwargs)
+
+    model = EmbeddingModel(n_neighbors=min(n_neighbors, len(idxs)),
+                           perplexity=min(n_neighbors, len(idxs)) / 3.)
+    model.set_embedding(X_land, xy_land)
+    xy = model.transform(X, n_iter=n_refine, chunk_size=chunk_size,
+                         random_state=random_state, n_jobs=n_jobs)
+    # landmarks keep their own coordinates
+    xy[idxs] = xy_land
+    return xy
+
+
+landmark_tsne.supports_callback = True
+register_embedder('landmark', landmark_tsne)
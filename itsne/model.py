@@ -0,0 +1,282 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Persisted embedding model that can place new samples into an existing layout.
+"""
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+from .embedders import get_embedder, embedder_name
+from .utils.utils import issparse
+
+
+def _as_float32(X):
+    """X as float32 ndarray, or float32 CSR matrix if X is sparse"""
+    if issparse(X):
+        return X.tocsr().astype(np.float32)
+    return np.asarray(X, dtype=np.float32)
+
+
+def _binary_search_perplexity(dists, perplexity, n_steps=64, tol=1e-5):
+    """Returns conditional probabilities, shape of `dists` (n, k), of each
+    row's neighbors using a gaussian kernel whose bandwidth is found by
+    bisection (vectorized over rows) to match `perplexity`"""
+    dists = np.asarray(dists, dtype=np.float64) ** 2
+    # shift by nearest distance for numerical stability
+    dists = dists - dists[:, :1]
+    n = len(dists)
+    target = np.log(perplexity)
+    beta = np.ones(n)
+    lo = np.full(n, -np.inf)
+    hi = np.full(n, np.inf)
+    for _ in range(n_steps):
+        P = np.exp(-dists * beta[:, None])
+        sum_P = np.maximum(P.sum(axis=1), 1e-12)
+        H = np.log(sum_P) + beta * (dists * P).sum(axis=1) / sum_P
+        diff = H - target
+        if np.all(np.abs(diff) < tol):
+            break
+        # entropy too high -> increase beta (narrower kernel)
+        up = diff > 0
+        lo[up] = beta[up]
+        hi[~up] = beta[~up]
+        beta = np.where(np.isinf(hi), beta * 2.,
+                        np.where(np.isinf(lo), beta / 2., (lo + hi) / 2.))
+
+    P = np.exp(-dists * beta[:, None])
+    return P / np.maximum(P.sum(axis=1, keepdims=True), 1e-12)
+
+
+class EmbeddingModel(object):
+    """Embedding of a reference dataset that can position new samples
+    without refitting.
+
+    New samples are initialized at the affinity-weighted average position of
+    their nearest reference neighbors and then refined with a short t-SNE
+    style optimization in which the reference points stay frozen. Cost is
+    proportional to the number of new samples.
+
+    Parameters
+    ------
+    embedder: str or callable, default='sklearn'
+        Engine used by `fit`. See `embedders.get_embedder`.
+
+    embed_kwargs: dict, default=None
+        Keyword arguments passed to the `embedder`.
+
+    n_neighbors: int, default=15
+        Number of reference neighbors used to place each new sample.
+
+    perplexity: float, default=5.
+        Perplexity of the affinities to the reference neighbors. Must be
+        less than `n_neighbors`.
+    """
+    def __init__(self, embedder='sklearn', embed_kwargs=None, n_neighbors=15,
+                 perplexity=5.):
+        self.embedder = embedder
+        self.embed_kwargs = embed_kwargs if embed_kwargs is not None else {}
+        self.n_neighbors = n_neighbors
+        self.perplexity = perplexity
+        self.X_ = None
+        self.xy_ = None
+        self._nn = None
+
+    def fit(self, X):
+        """Embeds reference data X and builds the neighbor index"""
+        xy = get_embedder(self.embedder)(X, **self.embed_kwargs)
+        return self.set_embedding(X, xy)
+
+    def fit_transform(self, X):
+        """Same as `fit`, but returns the coordinates of X"""
+        return self.fit(X).xy_
+
+    def set_embedding(self, X, xy):
+        """Uses precomputed coordinates `xy` of reference data X (e.g. the
+        return value of `plot_tsne`) instead of fitting"""
+        from sklearn.neighbors import NearestNeighbors
+
+        if X.shape[0] != len(xy):
+            raise RuntimeError("len(X) != len(xy) (%s != %s)"
+                               % (X.shape[0], len(xy)))
+        self.X_ = _as_float32(X)
+        self.xy_ = np.asarray(xy, dtype=np.float32)
+        self._nn = NearestNeighbors(n_neighbors=self.n_neighbors).fit(self.X_)
+        return self
+
+    @classmethod
+    def from_embedding(cls, X, xy, **kwargs):
+        """Creates model from precomputed coordinates, see `set_embedding`"""
+        return cls(**kwargs).set_embedding(X, xy)
+
+    def transform(self, X_new, n_iter=100, learning_rate=1., momentum=0.8,
+                  n_repulsion=1000, chunk_size=5000, random_state=None,
+                  n_jobs=1):
+        """Positions new samples in the existing layout.
+
+        Parameters
+        ------
+        X_new: array or scipy.sparse matrix, shape (n_new, n_features)
+            New samples, with the same features as the reference data. Only
+            read `chunk_size` rows at a time, so it may be a memmap larger
+            than memory.
+
+        n_iter: int, default=100
+            Number of optimization steps. If 0, only uses the kNN-weighted
+            initialization.
+
+        learning_rate: float, default=1.
+            Step size of the optimization.
+
+        momentum: float, default=0.8
+            Momentum of the optimization.
+
+        n_repulsion: int, default=1000
+            Number of reference points sampled (with replacement) to estimate
+            the repulsive forces acting on each new sample.
+
+        chunk_size: int, default=5000
+            Number of new samples optimized at a time.
+
+        random_state: int, default=None
+            Seed for sampling the repulsion points.
+
+        n_jobs: int, default=1
+            Number of chunks positioned in parallel threads, or all cpus if
+            -1. The result does not depend on `n_jobs`.
+
+        Returns
+        ------
+        xy_new: ndarray of shape (n_new, 2)
+        """
+        if self._nn is None:
+            raise RuntimeError("EmbeddingModel is not fitted yet")
+
+        n_new = X_new.shape[0]
+        xy_new = np.empty((n_new, self.xy_.shape[1]), dtype=np.float32)
+        starts = range(0, n_new, chunk_size)
+        # one seed per chunk, so chunks can be positioned in any order
+        seeds = np.random.RandomState(random_state).randint(
+            2 ** 31 - 1, size=len(starts))
+
+        def place(i):
+            start = starts[i]
+            stop = start + chunk_size
+            xy_new[start:stop] = self._transform_chunk(
+                _as_float32(X_new[start:stop]), n_iter, learning_rate,
+                momentum, n_repulsion, np.random.RandomState(seeds[i]))
+
+        if n_jobs is None or n_jobs < 0:
+            n_jobs = multiprocessing.cpu_count()
+        if n_jobs == 1 or len(starts) < 2:
+            for i in range(len(starts)):
+                place(i)
+        else:
+            pool = ThreadPool(n_jobs)
+            try:
+                pool.map(place, range(len(starts)))
+            finally:
+                pool.close()
+                pool.join()
+
+        return xy_new
+
+    def _transform_chunk(self, X_new, n_iter, learning_rate, momentum,
+                         n_repulsion, rng):
+        dists, nbrs = self._nn.kneighbors(X_new)
+        P = _binary_search_perplexity(dists, self.perplexity)
+
+        # (n, k, 2) coordinates of the frozen neighbors
+        Y_nbrs = self.xy_[nbrs].astype(np.float64)
+        Y = np.einsum('nk,nkd->nd', P, Y_nbrs)
+        if n_iter <= 0:
+            return Y
+
+        n_rep = min(n_repulsion, len(self.xy_))
+        update = np.zeros_like(Y)
+        for _ in range(n_iter):
+            # attractive forces to the reference neighbors
+            diff = Y[:, None, :] - Y_nbrs
+            w = 1. / (1. + np.sum(diff ** 2, axis=2))
+            attr = np.einsum('nk,nkd->nd', P * w, diff)
+
+            # repulsive forces, estimated from a sample of reference points.
+            # Drawn with replacement, which costs O(n_rep) instead of the
+            # O(n_ref) permutation behind replace=False
+            Y_rep = self.xy_[rng.randint(len(self.xy_), size=n_rep)]
+            diff = Y[:, None, :] - Y_rep[None, :, :]
+            w = 1. / (1. + np.sum(diff ** 2, axis=2))
+            rep = (np.einsum('ns,nsd->nd', w ** 2, diff)
+                   / w.sum(axis=1, keepdims=True))
+
+            grad = 4. * (attr - rep)
+            update = momentum * update - learning_rate * grad
+            Y += update
+
+        return Y
+
+    def save(self, path):
+        """Saves model (reference features, coordinates & params) to `path`
+        in .npz format. Sparse features are stored as their CSR
+        components"""
+        if self.X_ is None:
+            raise RuntimeError("EmbeddingModel is not fitted yet")
+        params = {'embedder': embedder_name(self.embedder),
+                  'embed_kwargs': self.embed_kwargs,
+                  'n_neighbors': self.n_neighbors,
+                  'perplexity': self.perplexity}
+        if issparse(self.X_):
+            X = {'X_data': self.X_.data, 'X_indices': self.X_.indices,
+                 'X_indptr': self.X_.indptr,
+                 'X_shape': np.array(self.X_.shape)}
+        else:
+            X = {'X': self.X_}
+        with open(path, 'wb') as f:
+            np.savez(f, xy=self.xy_,
+                     params=np.array(json.dumps(params, default=str)), **X)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a model saved with `save`. The neighbor index is rebuilt
+        from the stored reference features"""
+        with np.load(path, allow_pickle=False) as f:
+            params = json.loads(str(f['params']))
+            xy = f['xy']
+            if 'X' in f.files:
+                X = f['X']
+            else:
+                from scipy.sparse import csr_matrix
+                X = csr_matrix((f['X_data'], f['X_indices'], f['X_indptr']),
+                               shape=tuple(f['X_shape']))
+        return cls(**params).set_embedding(X, xy)
@@ -0,0 +1,193 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Nearest neighbor graphs of features, computed once and shared by embedders.
+
+t-SNE only ever looks at the nearest ~3 * perplexity neighbors of each
+sample, and finding them is the most expensive step for wide X. A graph
+computed here can be passed to `itsne.compute_tsne(..., knn=)` so several
+embeddings of the same features (e.g. different perplexities or seeds) pay
+for the search only once. Graphs computed elsewhere, as sparse distance
+matrices, are converted with `csr_to_knn`.
+"""
+import numpy as np
+
+from .utils.utils import issparse
+
+
+def n_neighbors_for(perplexity):
+    """Number of neighbors t-SNE needs for `perplexity`"""
+    return int(3. * perplexity + 1)
+
+
+def knn_graph(X, n_neighbors=91, chunk_size=10000, n_jobs=-1):
+    """Exact euclidean nearest neighbors of every row of X, excluding the
+    row itself.
+
+    Neighbors are queried over chunks of `chunk_size` rows, so apart from
+    the index of X, memory stays proportional to the output.
+
+    Parameters
+    ------
+    X: array or scipy.sparse matrix, shape (n_samples, n_features)
+        Features, may be a read-only np.memmap.
+
+    n_neighbors: int, default=91
+        Number of neighbors per sample, e.g. `n_neighbors_for(perplexity)`.
+        Capped at n_samples - 1.
+
+    chunk_size: int, default=10000
+        Number of rows queried at once.
+
+    n_jobs: int, default=-1
+        Number of threads of the neighbor search.
+
+    Returns
+    ------
+    knn: tuple (indices, distances)
+        Arrays of shape (n_samples, n_neighbors), int32 indices of the
+        neighbors of each sample and float32 euclidean distances to them,
+        sorted by increasing distance.
+    """
+    from sklearn.neighbors import NearestNeighbors
+
+    n_samples = X.shape[0]
+    n_neighbors = min(n_neighbors, n_samples - 1)
+    nn = NearestNeighbors(n_neighbors=n_neighbors + 1, n_jobs=n_jobs).fit(X)
+
+    indices = np.empty((n_samples, n_neighbors), dtype=np.int32)
+    distances = np.empty((n_samples, n_neighbors), dtype=np.float32)
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        dist, ind = nn.kneighbors(X[start:stop])
+
+        # drop each row itself, which is not necessarily the first neighbor
+        # when there are duplicate rows. Rows not found among their own
+        # neighbors drop their farthest one instead
+        is_self = ind == np.arange(start, stop)[:, None]
+        is_self[~is_self.any(axis=1), -1] = True
+        keep = ~is_self
+        indices[start:stop] = ind[keep].reshape(-1, n_neighbors)
+        distances[start:stop] = dist[keep].reshape(-1, n_neighbors)
+
+    return indices, distances
+
+
+def check_knn(knn, n_samples=None):
+    """Returns (indices, distances) of `knn` as arrays after checking they
+    have one row per sample, if `n_samples` is given"""
+    try:
+        indices, distances = knn
+    except (TypeError, ValueError):
+        raise RuntimeError("knn should be a tuple (indices, distances)")
+    indices, distances = np.asarray(indices), np.asarray(distances)
+    if indices.shape != distances.shape or indices.ndim != 2:
+        raise RuntimeError("knn indices and distances should both have shape "
+                           "(n_samples, n_neighbors). Got %s and %s"
+                           % (indices.shape, distances.shape))
+    if n_samples is not None and len(indices) != n_samples:
+        raise RuntimeError("len(knn) != len(X) (%s != %s)"
+                           % (len(indices), n_samples))
+    return indices, distances
+
+
+def knn_to_csr(indices, distances, n_neighbors=None, squared=False):
+    """Sparse (n_samples, n_samples) distance matrix with the first
+    `n_neighbors` neighbors of every row, plus the row itself as an explicit
+    zero, as expected by the `metric='precomputed'` of scikit-learn
+    estimators"""
+    from scipy.sparse import csr_matrix
+
+    if n_neighbors is not None:
+        indices = indices[:, :n_neighbors]
+        distances = distances[:, :n_neighbors]
+    n_samples, k = indices.shape
+    ind = np.empty((n_samples, k + 1), dtype=np.int32)
+    ind[:, 0] = np.arange(n_samples)
+    ind[:, 1:] = indices
+    data = np.zeros((n_samples, k + 1), dtype=np.float32)
+    data[:, 1:] = distances
+    if squared:
+        data **= 2
+    indptr = np.arange(0, n_samples * (k + 1) + 1, k + 1)
+    return csr_matrix((data.ravel(), ind.ravel(), indptr),
+                      shape=(n_samples, n_samples))
+
+
+def csr_to_knn(graph, n_neighbors=None):
+    """Nearest neighbors (indices, distances) of every row of a sparse
+    (n_samples, n_samples) distance matrix, such as the output of
+    `sklearn.neighbors.kneighbors_graph(X, mode='distance')`.
+
+    Stored entries are the candidate neighbors of each row (explicit zeros,
+    e.g. duplicates, included) and the diagonal is ignored. Works on the
+    stored entries only, so memory stays proportional to the graph.
+
+    Parameters
+    ------
+    graph: scipy.sparse matrix, shape (n_samples, n_samples)
+        Distances from each sample to its neighbors.
+
+    n_neighbors: int, default=None
+        Number of neighbors per sample. If None, the smallest number of
+        neighbors stored for any sample.
+
+    Returns
+    ------
+    knn: tuple (indices, distances)
+        Arrays of shape (n_samples, n_neighbors), see `knn_graph`.
+    """
+    if not issparse(graph) or graph.shape[0] != graph.shape[1]:
+        raise RuntimeError("Precomputed graph should be a sparse matrix of "
+                           "shape (n_samples, n_samples)")
+    graph = graph.tocsr()
+    n_samples = graph.shape[0]
+    rows = np.repeat(np.arange(n_samples), np.diff(graph.indptr))
+    keep = graph.indices != rows
+    rows, cols, data = rows[keep], graph.indices[keep], graph.data[keep]
+
+    counts = np.bincount(rows, minlength=n_samples)
+    if n_neighbors is None:
+        n_neighbors = counts.min()
+    if n_neighbors < 1 or counts.min() < n_neighbors:
+        raise RuntimeError("Every sample of the precomputed graph needs at "
+                           "least %i neighbors, but some have only %i"
+                           % (max(n_neighbors, 1), counts.min()))
+
+    # sort entries by row, then distance, and keep the first n_neighbors
+    order = np.lexsort((data, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    rank = np.arange(len(rows)) - (np.cumsum(counts) - counts)[rows]
+    first = rank < n_neighbors
+    return (cols[first].astype(np.int32).reshape(n_samples, n_neighbors),
+            data[first].astype(np.float32).reshape(n_samples, n_neighbors))
@@ -0,0 +1,127 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Anytime t-SNE: stopping the optimization early and taking snapshots of it.
+
+Embedders that `supports_callback` call `callback(iteration, kl_divergence,
+xy)` every few iterations while optimizing, and stop as soon as it returns
+True. `AnytimeMonitor` is such a callback, used by `itsne.compute_tsne` when
+a time budget, KL tolerance or snapshots are requested.
+"""
+import time
+
+
+class AnytimeMonitor(object):
+    """Embedder callback that stops t-SNE once a wall-clock budget is spent
+    or the KL divergence stops improving, and hands out snapshots of the
+    layout along the way.
+
+    The budget and tolerance are checked whenever the embedder reports
+    progress, i.e. every `callback_every` iterations, so the optimization
+    may overrun `time_budget` by up to that many iterations.
+
+    Parameters
+    ------
+    time_budget: float, default=None
+        Seconds after which to stop, counted from the creation of the
+        monitor. If None, no time limit.
+
+    kl_tol: float, default=None
+        Stop once the KL divergence improved by less than `kl_tol` (relative)
+        since the previous report. If None, run all iterations.
+
+    min_iter: int, default=250
+        Iterations before `kl_tol` is checked, so the early exaggeration
+        phase (250 iterations by default), whose KL divergence is not
+        comparable, is never mistaken for convergence.
+
+    snapshot_every: int, default=None
+        If provided with `on_snapshot`, calls `on_snapshot(iteration, xy)`
+        at most every `snapshot_every` iterations.
+
+    on_snapshot: callable, default=None
+        Receives snapshots of the layout, see `snapshot_every`.
+
+    callback: callable, default=None
+        Also called with every report, e.g. `profiler.on_iteration`.
+
+    Attributes
+    ------
+    n_iter: int
+        Last iteration reported.
+
+    kl_divergence: float
+        Last KL divergence reported.
+
+    stop_reason: str
+        'time_budget' or 'kl_tol' if the monitor stopped the optimization,
+        else None.
+    """
+    def __init__(self, time_budget=None, kl_tol=None, min_iter=250,
+                 snapshot_every=None, on_snapshot=None, callback=None):
+        self.time_budget = time_budget
+        self.kl_tol = kl_tol
+        self.min_iter = min_iter
+        self.snapshot_every = snapshot_every
+        self.on_snapshot = on_snapshot
+        self.callback = callback
+        self.start = time.time()
+        self.n_iter = 0
+        self.kl_divergence = None
+        self.stop_reason = None
+        self._last_snapshot = 0
+
+    def elapsed(self):
+        """Seconds since the monitor was created"""
+        return time.time() - self.start
+
+    def __call__(self, iteration, kl_divergence, xy=None):
+        if self.callback is not None:
+            self.callback(iteration, kl_divergence, xy)
+
+        if (self.on_snapshot is not None and self.snapshot_every
+                and xy is not None
+                and iteration - self._last_snapshot >= self.snapshot_every):
+            self._last_snapshot = iteration
+            self.on_snapshot(iteration, xy)
+
+        last_iter, last_kl = self.n_iter, self.kl_divergence
+        self.n_iter, self.kl_divergence = iteration, kl_divergence
+        if (self.time_budget is not None
+                and self.elapsed() >= self.time_budget):
+            self.stop_reason = 'time_budget'
+        elif (self.kl_tol is not None and last_iter >= self.min_iter
+                and last_kl is not None and kl_divergence is not None
+                and last_kl - kl_divergence < self.kl_tol * abs(last_kl)):
+            self.stop_reason = 'kl_tol'
+        return self.stop_reason is not None
@@ -0,0 +1,151 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Dimensionality reduction applied to features before embedding/clustering.
+
+Wide feature arrays make the nearest neighbor search of t-SNE (and KMeans)
+slow and memory hungry. Projecting down to ~50 dimensions first keeps most of
+the neighborhood structure at a fraction of the cost.
+"""
+import numpy as np
+
+from .utils.utils import issparse, read_rows
+
+
+def _fit_incremental_pca(X, n_components, chunk_size, random_state):
+    from sklearn.decomposition import IncrementalPCA
+
+    model = IncrementalPCA(n_components=n_components)
+    # IncrementalPCA requires every chunk to have >= n_components rows, so
+    # fold a short trailing chunk into the previous one
+    starts = list(range(0, len(X), chunk_size))
+    if len(starts) > 1 and len(X) - starts[-1] < n_components:
+        starts.pop()
+    for i, start in enumerate(starts):
+        stop = starts[i + 1] if i + 1 < len(starts) else len(X)
+        model.partial_fit(np.asarray(X[start:stop], dtype=np.float32))
+    return model
+
+
+def _fit_randomized_pca(X, n_components, chunk_size, random_state):
+    from sklearn.decomposition import PCA
+
+    return PCA(n_components=n_components, svd_solver='randomized',
+               random_state=random_state).fit(
+                   np.asarray(X, dtype=np.float32))
+
+
+def _fit_random_projection(X, n_components, chunk_size, random_state):
+    from sklearn.random_projection import SparseRandomProjection
+
+    model = SparseRandomProjection(n_components=n_components,
+                                   dense_output=True,
+                                   random_state=random_state)
+    # only the shape of X is used to draw the projection matrix
+    return model.fit(X[:min(X.shape[0], n_components + 1)])
+
+
+def _fit_truncated_svd(X, n_components, chunk_size, random_state):
+    from sklearn.decomposition import TruncatedSVD
+
+    # no centering, so sparse X is never densified
+    return TruncatedSVD(n_components=n_components,
+                        random_state=random_state).fit(X)
+
+
+REDUCERS = {'pca': _fit_incremental_pca,
+            'randomized_pca': _fit_randomized_pca,
+            'random_projection': _fit_random_projection,
+            'truncated_svd': _fit_truncated_svd}
+
+# methods that need dense X
+_DENSE_ONLY = ('pca', 'randomized_pca')
+
+
+def reduce_dims(X, method='pca', n_components=50, chunk_size=10000,
+                random_state=None):
+    """Reduces the feature dimension of X, working in float32 and over chunks
+    of rows so peak memory stays close to the size of the output.
+
+    Parameters
+    ------
+    X: array or scipy.sparse matrix, shape (n_samples, n_features)
+        Feature array. May be a np.memmap.
+
+    method: str, default='pca'
+        One of 'pca' (incremental PCA fit over chunks), 'randomized_pca'
+        (randomized SVD over all of X at once), 'random_projection'
+        (sparse random projection, no fitting pass over the data), or
+        'truncated_svd' (randomized SVD without centering, i.e. LSA). Only
+        the last two accept sparse X.
+
+    n_components: int, default=50
+        Number of dimensions to reduce to. If X already has at most
+        `n_components` features, X is returned as float32 unchanged (and
+        still sparse, if sparse). 'pca' and 'randomized_pca' cannot find
+        more components than X has rows, so for them it is capped at
+        n_samples.
+
+    chunk_size: int, default=10000
+        Number of rows processed at a time.
+
+    random_state: int, default=None
+        Seed for the randomized methods.
+
+    Returns
+    ------
+    X_red: ndarray of shape (n_samples, n_components), dtype float32
+    """
+    if method not in REDUCERS:
+        raise RuntimeError("Do not recognize reduction method = %s. Choose "
+                           "one of %s" % (method, sorted(REDUCERS.keys())))
+    if issparse(X) and method in _DENSE_ONLY:
+        raise RuntimeError("Reduction method = %s would densify sparse X. "
+                           "Use 'truncated_svd' or 'random_projection'"
+                           % method)
+    if X.shape[1] <= n_components:
+        return read_rows(X, 0, X.shape[0], dtype=np.float32)
+    if method in _DENSE_ONLY:
+        n_components = min(n_components, X.shape[0])
+        # every incremental chunk needs at least n_components rows
+        chunk_size = max(chunk_size, n_components)
+
+    model = REDUCERS[method](X, n_components, chunk_size, random_state)
+
+    n_samples = X.shape[0]
+    X_red = np.empty((n_samples, n_components), dtype=np.float32)
+    for start in range(0, n_samples, chunk_size):
+        chunk = read_rows(X, start, start + chunk_size, dtype=np.float32)
+        X_red[start:start + chunk_size] = model.transform(chunk)
+
+    return X_red
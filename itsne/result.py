@@ -0,0 +1,111 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Result of the compute stage of itsne, which can be rendered many times.
+"""
+import numpy as np
+
+
+class TSNEResult(object):
+    """Everything needed to render an itsne plot, without the features.
+
+    Returned by `itsne.compute_tsne` and consumed by `itsne.render_tsne`.
+    Can be saved to and loaded from a single .npz file, so the (expensive)
+    compute stage and the (cheap) render stage can run on different machines.
+
+    Parameters
+    ------
+    xy: ndarray of shape (n_samples, 2)
+        t-SNE coordinates of every sample.
+
+    labels: ndarray of shape (n_samples,)
+        Label (given or computed cluster) of every sample.
+
+    idxs: ndarray of shape (n_plot,)
+        Indexes of the samples to draw individually.
+
+    codes: ndarray of shape (n_samples,)
+        Index into `palette` of every sample's color.
+
+    palette: ndarray of shape (n_colors, 3)
+        RGB colors in [0, 255], one per unique label.
+
+    uids: ndarray of shape (n_samples,), default=None
+        Uids of every sample, shown on hover.
+
+    labels_provided: bool, default=False
+        Whether `labels` were given by the user (shown on hover) or computed
+        by clustering.
+    """
+    def __init__(self, xy, labels, idxs, codes, palette, uids=None,
+                 labels_provided=False):
+        self.xy = np.asarray(xy)
+        self.labels = np.asarray(labels)
+        self.idxs = np.asarray(idxs, dtype=int)
+        self.codes = np.asarray(codes)
+        self.palette = np.asarray(palette)
+        self.uids = np.asarray(uids) if uids is not None else None
+        self.labels_provided = bool(labels_provided)
+
+    def __len__(self):
+        return len(self.xy)
+
+    def __repr__(self):
+        return ("TSNEResult(n_samples=%i, n_plot=%i, n_labels=%i)"
+                % (len(self.xy), len(self.idxs), len(self.palette)))
+
+    def save(self, path):
+        """Saves result to `path` in compressed .npz format"""
+        arrays = {'xy': self.xy, 'idxs': self.idxs, 'codes': self.codes,
+                  'palette': self.palette,
+                  'labels_provided': np.array(self.labels_provided)}
+        # strings are stored as fixed-width unicode so no pickling is needed
+        for name in ('labels', 'uids'):
+            arr = getattr(self, name)
+            if arr is None:
+                continue
+            if arr.dtype == object:
+                arr = arr.astype(np.str_)
+            arrays[name] = arr
+
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Loads result saved with `save`"""
+        with np.load(path, allow_pickle=False) as f:
+            return cls(f['xy'], f['labels'], f['idxs'], f['codes'],
+                       f['palette'],
+                       uids=f['uids'] if 'uids' in f.files else None,
+                       labels_provided=bool(f['labels_provided']))
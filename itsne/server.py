@@ -0,0 +1,250 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Bokeh server for browsing very large embeddings.
+
+The embedding is held in memory on the server, indexed by a uniform grid.
+Whenever the browser pans or zooms, only the points (and thumbnails) inside
+the visible viewport are sent, capped at a fixed number, so memory in the
+browser stays bounded regardless of the size of the dataset.
+
+Run as `python -m itsne.server result.npz` on a result saved with
+`TSNEResult.save`, or call `serve(result)` from python.
+"""
+import argparse
+import bokeh.plotting as bkp
+import bokeh.models as bkm
+import numpy as np
+
+# local imports
+from .utils import colors, bokeh_utils
+from .result import TSNEResult
+
+
+class GridIndex(object):
+    """Uniform grid over 2-d points for fast rectangular range queries.
+
+    Every point also gets a random priority. When a query matches more than
+    `max_points`, the points with the highest priority are returned, so the
+    points shown are stable while zooming and get denser as the viewport
+    shrinks.
+
+    Parameters
+    ------
+    xy: ndarray of shape (n_points, 2)
+
+    n_cells: int, default=256
+        Number of grid cells along each axis.
+
+    random_state: int, default=0
+        Seed for the point priorities.
+    """
+    def __init__(self, xy, n_cells=256, random_state=0):
+        self.xy = np.asarray(xy)
+        self.n_cells = n_cells
+        self.lo = self.xy.min(axis=0)
+        self.size = np.maximum(self.xy.max(axis=0) - self.lo, 1e-12) / n_cells
+
+        cells = self._cell(self.xy)
+        cell_ids = cells[:, 1] * n_cells + cells[:, 0]
+        self.order = np.argsort(cell_ids, kind='mergesort')
+        self.offsets = np.searchsorted(cell_ids[self.order],
+                                       np.arange(n_cells * n_cells + 1))
+        rng = np.random.RandomState(random_state)
+        self.priority = rng.permutation(len(self.xy))
+
+    def _cell(self, xy):
+        return np.clip(((xy - self.lo) / self.size).astype(np.int64), 0,
+                       self.n_cells - 1)
+
+    def query(self, x0, x1, y0, y1, max_points=None):
+        """Returns indexes of points within [x0, x1] x [y0, y1], at most
+        `max_points` of them"""
+        (c0, r0), (c1, r1) = self._cell(np.array([[x0, y0], [x1, y1]]))
+        cand = [self.order[self.offsets[r * self.n_cells + c0]:
+                           self.offsets[r * self.n_cells + c1 + 1]]
+                for r in range(r0, r1 + 1)]
+        cand = np.concatenate(cand) if cand else np.zeros(0, dtype=int)
+
+        # cells on the border are only partially in view
+        pts = self.xy[cand]
+        cand = cand[(pts[:, 0] >= x0) & (pts[:, 0] <= x1) &
+                    (pts[:, 1] >= y0) & (pts[:, 1] <= y1)]
+
+        if max_points is not None and len(cand) > max_points:
+            keep = np.argpartition(-self.priority[cand], max_points)
+            cand = cand[keep[:max_points]]
+        return cand
+
+
+def make_app(result, imgs=None, img_alpha=255, max_points=5000,
+             max_imgs=300, refresh_ms=200):
+    """Returns function `f(doc)` that builds the viewport-driven plot of
+    `result` into a bokeh document, for use with a bokeh server.
+
+    Parameters
+    ------
+    result: `result.TSNEResult`
+        Output of `compute_tsne`.
+
+    imgs: array, shape (n_samples, _img_shape_), default=None
+        Images of every sample (may be a np.memmap or
+        `utils.images.ImageSource`). Drawn once at most `max_imgs` points
+        are in view.
+
+    img_alpha: int, default=255
+        Transparency of images, in [0, 255].
+
+    max_points: int, default=5000
+        Maximum number of points sent to the browser at once.
+
+    max_imgs: int, default=300
+        Images are shown when at most this many points are in view.
+
+    refresh_ms: int, default=200
+        Changes of the viewport are collected for this long before the
+        points in view are queried, so a pan or zoom queries once rather
+        than on every range update.
+    """
+    xy = np.asarray(result.xy, dtype=np.float64)
+    index = GridIndex(xy)
+    hexes = list(colors.rgb_to_hex(result.palette))
+    # images are drawn as squares 1/40th of the smaller side of the layout
+    img_w = img_h = np.min(xy.max(axis=0) - xy.min(axis=0)) / 40.
+
+    def points_data(idxs):
+        data = {'x': xy[idxs, 0], 'y': xy[idxs, 1],
+                'color': result.codes[idxs]}
+        if result.uids is not None:
+            data['uids'] = result.uids[idxs]
+        if result.labels_provided:
+            data['labels'] = result.labels[idxs]
+        return data
+
+    def images_data(idxs):
+        if imgs is None or len(idxs) > max_imgs or len(idxs) == 0:
+            return {'image': [], 'x': [], 'y': [], 'dw': [], 'dh': []}
+        idxs = np.sort(idxs)
+        bimgs = bokeh_utils.preproc_imgs(imgs[idxs], alpha=img_alpha)
+        return {'image': list(bimgs), 'x': xy[idxs, 0] - img_w / 2.,
+                'y': xy[idxs, 1] - img_h / 2., 'dw': [img_w] * len(idxs),
+                'dh': [img_h] * len(idxs)}
+
+    def modify_doc(doc):
+        lo, hi = xy.min(axis=0), xy.max(axis=0)
+        idxs = index.query(lo[0], hi[0], lo[1], hi[1], max_points)
+        pts = bkp.ColumnDataSource(data=points_data(idxs))
+        ims = bkp.ColumnDataSource(data=images_data(idxs))
+
+        p = bkp.figure(plot_width=1200, plot_height=800,
+                       x_range=bkm.Range1d(lo[0], hi[0]),
+                       y_range=bkm.Range1d(lo[1], hi[1]))
+        mapper = bkm.LinearColorMapper(palette=hexes, low=-0.5,
+                                       high=len(hexes) - 0.5)
+        cmap = {'field': 'color', 'transform': mapper}
+        p.circle('x', 'y', source=pts, fill_color=cmap, line_color=cmap,
+                 fill_alpha=0.35, line_alpha=0.9, line_width=2, size=8)
+        p.image_rgba(image='image', x='x', y='y', dw='dw', dh='dh',
+                     source=ims)
+
+        hover_tt = []
+        if result.uids is not None:
+            hover_tt.append(('uid', '@uids'))
+        if result.labels_provided:
+            hover_tt.append(('label', '@labels'))
+        p.add_tools(bkm.HoverTool(tooltips=hover_tt))
+
+        last = [None]
+        pending = [False]
+
+        def update():
+            pending[0] = False
+            view = (p.x_range.start, p.x_range.end,
+                    p.y_range.start, p.y_range.end)
+            if view == last[0] or None in view:
+                return
+            last[0] = view
+            idxs = index.query(min(view[:2]), max(view[:2]),
+                               min(view[2:]), max(view[2:]), max_points)
+            pts.data = points_data(idxs)
+            ims.data = images_data(idxs)
+
+        def on_range(attr, old, new):
+            if not pending[0]:
+                pending[0] = True
+                doc.add_timeout_callback(update, refresh_ms)
+
+        for rng in (p.x_range, p.y_range):
+            rng.on_change('start', on_range)
+            rng.on_change('end', on_range)
+        doc.add_root(p)
+
+    return modify_doc
+
+
+def serve(result, imgs=None, port=5006, show=True, **kwargs):
+    """Serves the viewport-driven plot of `result` on localhost:`port` until
+    interrupted. `kwargs` are passed to `make_app`"""
+    from bokeh.application import Application
+    from bokeh.application.handlers.function import FunctionHandler
+    from bokeh.server.server import Server
+
+    app = Application(FunctionHandler(make_app(result, imgs=imgs, **kwargs)))
+    server = Server({'/': app}, port=port, address='localhost',
+                    allow_websocket_origin=['localhost:%i' % port])
+    server.start()
+    if show:
+        server.io_loop.add_callback(server.show, '/')
+    server.io_loop.start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve an itsne result saved with TSNEResult.save")
+    parser.add_argument('result', help="path of saved TSNEResult (.npz)")
+    parser.add_argument('--imgs', default=None,
+                        help="path of .npy stack of images, one per sample")
+    parser.add_argument('--port', type=int, default=5006)
+    parser.add_argument('--max-points', type=int, default=5000)
+    parser.add_argument('--no-show', action='store_true',
+                        help="don't open a browser")
+    args = parser.parse_args(argv)
+
+    result = TSNEResult.load(args.result)
+    imgs = np.load(args.imgs, mmap_mode='r') if args.imgs else None
+    serve(result, imgs=imgs, port=args.port, show=not args.no_show,
+          max_points=args.max_points)
+
+
+if __name__ == '__main__':
+    main()
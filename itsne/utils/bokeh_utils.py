@@ -33,13 +33,15 @@
 """
 Bokeh utility functions
 """
-from PIL import Image
+import base64
+import io
 import numpy as np
 
 
 def convert_to_RGBA(img, alpha=None):
     """Converts input PIL Image or nparray to RGBA. Returns ndarray of shape
     (H, W, 4), where the last channel dimension is `alpha`, the transparency"""
+    from PIL import Image
     try:
         if img.mode != "RGBA":
             img = np.array(img.convert("RGBA"))
@@ -72,3 +74,299 @@ def preproc_img(img, flip_ud=True, alpha=None):
     # convert img to be 2d arr (M x N) with dtype = uint32 -- for bokeh
     bimg = np.squeeze(img.astype(np.uint8).view(np.uint32))
     return bimg
+
+
+def preproc_imgs(imgs, flip_ud=True, alpha=None, out=None):
+    """Batched version of `preproc_img` for a stack of images.
+
+    Parameters
+    ------
+    imgs: ndarray of shape (N, H, W) or (N, H, W, C), C in {1, 2, 3, 4}
+        Stack of greyscale, greyscale+alpha, RGB or RGBA images, normally
+        dtype uint8.
+
+    flip_ud: bool, default=True
+        Whether to flip images vertically to bokeh's bottom-left origin.
+
+    alpha: int, default=None
+        If provided, overwrite the transparency of every pixel with `alpha`,
+        which must be in [0, 255].
+
+    out: ndarray of shape (N, H, W), dtype uint32, default=None
+        Preallocated output buffer. Allocated if None.
+
+    Returns
+    ------
+    bimgs: ndarray of shape (N, H, W), dtype uint32
+        RGBA images packed into uint32, ready for `figure.image_rgba`.
+    """
+    imgs = np.asarray(imgs)
+    if imgs.ndim == 3:
+        imgs = imgs[..., None]
+    if imgs.ndim != 4 or imgs.shape[3] not in (1, 2, 3, 4):
+        raise RuntimeError("Can't preprocess image stack of shape %s"
+                           % (imgs.shape,))
+    if alpha is not None and not (alpha >= 0 and alpha <= 255):
+        raise RuntimeError("alpha must be between [0, 255]")
+
+    N, H, W, C = imgs.shape
+    if out is None:
+        out = np.empty((N, H, W), dtype=np.uint32)
+    elif out.shape != (N, H, W) or out.dtype != np.uint32:
+        raise RuntimeError("out must be uint32 of shape %s" % ((N, H, W),))
+
+    # write straight into the bytes of the uint32 buffer
+    rgba = out.view(np.uint8).reshape(N, H, W, 4)
+    if flip_ud:
+        imgs = imgs[:, ::-1]
+
+    if C <= 2:
+        rgba[..., :3] = imgs[..., :1]
+    else:
+        rgba[..., :3] = imgs[..., :3]
+
+    if alpha is not None:
+        rgba[..., 3] = int(alpha)
+    elif C in (2, 4):
+        rgba[..., 3] = imgs[..., C - 1]
+    else:
+        rgba[..., 3] = 255
+
+    return out
+
+
+def downsample_imgs(imgs, factor, chunk_size=None):
+    """Shrinks a stack of RGBA images by an integer `factor` with a box
+    (area) filter: each output pixel is the alpha-weighted average of a
+    `factor` x `factor` block of input pixels, so transparent pixels don't
+    darken their neighbors. Edges are padded by repetition when the image
+    size is not a multiple of `factor`.
+
+    Parameters
+    ------
+    imgs: ndarray of shape (N, H, W, 4), dtype uint8
+        RGBA images.
+
+    factor: int
+        Downsampling factor. If 1, `imgs` is returned as is.
+
+    chunk_size: int, default=None
+        Number of images filtered at a time, bounding the temporary memory.
+        If None, as many as take about 64MB of temporaries.
+
+    Returns
+    ------
+    small: ndarray of shape (N, ceil(H / factor), ceil(W / factor), 4),
+           dtype uint8
+    """
+    if factor == 1:
+        return imgs
+    N, H, W, _ = imgs.shape
+    h, w = -(-H // factor), -(-W // factor)
+    n_px = factor * factor
+    if chunk_size is None:
+        chunk_size = max(1, (1 << 26) // (H * W * 16))
+    out = np.empty((N, h, w, 4), dtype=np.uint8)
+    for start in range(0, N, chunk_size):
+        chunk = imgs[start:start + chunk_size]
+        if h * factor != H or w * factor != W:
+            chunk = np.pad(chunk, ((0, 0), (0, h * factor - H),
+                                   (0, w * factor - W), (0, 0)), mode='edge')
+        # (n, h, factor, w, factor, 4) blocks, summed in integers
+        blocks = chunk.reshape(len(chunk), h, factor, w, factor, 4)
+        alpha = blocks[..., 3].astype(np.uint32)
+        a_sum = alpha.sum(axis=(2, 4))
+        rgb = (blocks[..., :3] * alpha[..., None]).sum(axis=(2, 4))
+        dst = out[start:start + chunk_size]
+        dst[..., :3] = ((rgb + a_sum[..., None] // 2)
+                        // np.maximum(a_sum, 1)[..., None])
+        dst[..., 3] = (a_sum + n_px // 2) // n_px
+
+    return out
+
+
+def image_pyramid(imgs, factors):
+    """Returns dict of downsampling factor -> `downsample_imgs(imgs,
+    factor)` for every factor in `factors`. Each level is computed from the
+    next finer one, so the whole pyramid costs little more than its first
+    level when `factors` are powers of two"""
+    levels = {1: imgs}
+    for factor in sorted(factors):
+        finer = max(f for f in levels if factor % f == 0)
+        levels[factor] = downsample_imgs(levels[finer], factor // finer)
+    return dict((f, levels[f]) for f in factors)
+
+
+def _blend_into(dst, src):
+    """Alpha-composites RGBA uint8 `src` over `dst` in-place (same shape)"""
+    a_s = src[..., 3:].astype(np.float32) / 255.
+    a_d = dst[..., 3:].astype(np.float32) / 255.
+    a_o = a_s + a_d * (1. - a_s)
+    rgb = (src[..., :3] * a_s + dst[..., :3] * (a_d * (1. - a_s)))
+    rgb /= np.maximum(a_o, 1e-6)
+    dst[..., :3] = np.clip(rgb + 0.5, 0, 255).astype(np.uint8)
+    dst[..., 3:] = np.clip(a_o * 255. + 0.5, 0, 255).astype(np.uint8)
+
+
+def compose_atlas(imgs, x, y, dw, dh, max_tile_px=4096):
+    """Composes many images into a few large images (tiles), so they can be
+    drawn by a single bokeh renderer instead of one renderer per image.
+
+    Parameters
+    ------
+    imgs: iterable of ndarray of shape (H, W, 4), dtype uint8
+        RGBA images, already flipped to bokeh's bottom-left origin (see
+        `preproc_img`). All images must have the same shape.
+
+    x, y: ndarray of shape (n_imgs,)
+        Data coordinates of the bottom left corner of each image.
+
+    dw, dh: float
+        Width & height of each image in data coordinates.
+
+    max_tile_px: int, default=4096
+        Maximum width/height in pixels of each tile.
+
+    Returns
+    ------
+    tiles: list of dict
+        Each with keys 'image' (2d ndarray, dtype uint32), 'x', 'y', 'dw',
+        'dh' ready to pass to `figure.image_rgba`. Images are pasted at
+        their native resolution, in order, alpha-composited over earlier
+        images where they overlap.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) == 0:
+        return []
+
+    imgs = list(imgs)
+    H, W = imgs[0].shape[:2]
+    # pixels per data unit along each axis
+    ppu_x, ppu_y = W / float(dw), H / float(dh)
+    x0, y0 = np.min(x), np.min(y)
+    cols = np.round((x - x0) * ppu_x).astype(int)
+    rows = np.round((y - y0) * ppu_y).astype(int)
+    n_rows, n_cols = np.max(rows) + H, np.max(cols) + W
+
+    canvas = np.zeros((n_rows, n_cols, 4), dtype=np.uint8)
+    for img, r, c in zip(imgs, rows, cols):
+        region = canvas[r:r + H, c:c + W]
+        if img[..., 3].min() == 255:
+            region[...] = img
+        else:
+            _blend_into(region, img)
+
+    tiles = []
+    for r in range(0, n_rows, max_tile_px):
+        for c in range(0, n_cols, max_tile_px):
+            tile = canvas[r:r + max_tile_px, c:c + max_tile_px]
+            if not tile[..., 3].any():
+                continue
+            th, tw = tile.shape[:2]
+            tiles.append({'image': np.ascontiguousarray(tile).view(
+                              np.uint32).reshape(th, tw),
+                          'x': x0 + c / ppu_x, 'y': y0 + r / ppu_y,
+                          'dw': tw / ppu_x, 'dh': th / ppu_y})
+
+    return tiles
+
+
+def rasterize_density(x, y, codes, palette, bins=512, x_range=None,
+                      y_range=None):
+    """Rasterizes points into a single RGBA density image, where each pixel
+    is colored by the average color of the points falling in it and its
+    transparency by the log of their count. Work is a few `np.bincount`
+    passes over the points, so millions of points take well under a second.
+
+    Parameters
+    ------
+    x, y: ndarray of shape (n_points,)
+        Coordinates of points.
+
+    codes: ndarray of shape (n_points,), dtype int
+        Index into `palette` of each point's color.
+
+    palette: ndarray of shape (n_colors, 3)
+        RGB colors in [0, 255].
+
+    bins: int or tuple (n_x, n_y), default=512
+        Number of pixels along x & y.
+
+    x_range, y_range: tuple (min, max), default=None
+        Extent of the image in data coordinates. Defaults to the extent of
+        the points.
+
+    Returns
+    ------
+    raster: dict
+        With keys 'image' (2d ndarray of dtype uint32, bottom-left origin),
+        'x', 'y', 'dw', 'dh' ready to pass to `figure.image_rgba`.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n_x, n_y = (bins, bins) if np.isscalar(bins) else bins
+    if x_range is None:
+        x_range = (np.min(x), np.max(x))
+    if y_range is None:
+        y_range = (np.min(y), np.max(y))
+    dw = max(x_range[1] - x_range[0], 1e-12)
+    dh = max(y_range[1] - y_range[0], 1e-12)
+
+    col = np.clip(((x - x_range[0]) / dw * n_x).astype(np.int64), 0, n_x - 1)
+    row = np.clip(((y - y_range[0]) / dh * n_y).astype(np.int64), 0, n_y - 1)
+    pix = row * n_x + col
+
+    n_pix = n_x * n_y
+    counts = np.bincount(pix, minlength=n_pix).astype(np.float64)
+    rgb_pts = np.asarray(palette, dtype=np.float64)[codes]
+
+    rgba = np.zeros((n_pix, 4), dtype=np.uint8)
+    nz = counts > 0
+    for c in range(3):
+        summed = np.bincount(pix, weights=rgb_pts[:, c], minlength=n_pix)
+        rgba[nz, c] = np.round(summed[nz] / counts[nz]).astype(np.uint8)
+
+    # log-scaled density as alpha, so sparse regions remain visible
+    alpha = np.log1p(counts) / np.log1p(max(counts.max(), 1.))
+    rgba[nz, 3] = np.round(55 + 200 * alpha[nz]).astype(np.uint8)
+
+    image = rgba.view(np.uint32).reshape(n_y, n_x)
+    return {'image': image, 'x': x_range[0], 'y': y_range[0],
+            'dw': dw, 'dh': dh}
+
+
+def png_data_uri(img):
+    """Encodes a RGBA uint8 image of shape (H, W, 4), with top-left origin,
+    as a base64 PNG data URI, for `figure.image_url`. Uses the smallest PNG
+    color mode (L, LA, RGB or RGBA) that represents the image exactly"""
+    img = np.asarray(img)
+    grey = (np.array_equal(img[..., 0], img[..., 1])
+            and np.array_equal(img[..., 0], img[..., 2]))
+    opaque = img[..., 3].min() == 255
+    if grey:
+        img = img[..., 0] if opaque else img[..., [0, 3]]
+    elif opaque:
+        img = img[..., :3]
+
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(img)).save(buf, format='PNG',
+                                                    optimize=True)
+    return 'data:image/png;base64,' + \
+        base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+def smallest_int_dtype(arr):
+    """Returns `arr` cast to the smallest unsigned/signed integer dtype that
+    holds its values (bokeh ships integer arrays as binary)"""
+    arr = np.asarray(arr)
+    if len(arr) == 0:
+        return arr
+    lo, hi = arr.min(), arr.max()
+    for dtype in (np.uint8, np.int8, np.uint16, np.int16, np.uint32,
+                  np.int32):
+        info = np.iinfo(dtype)
+        if lo >= info.min and hi <= info.max:
+            return arr.astype(dtype)
+    return arr
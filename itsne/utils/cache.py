@@ -0,0 +1,188 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Persistent on-disk cache of computed embeddings, keyed by content of the data.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+from .utils import issparse
+
+# rows are hashed in chunks of about this many bytes so we never make a full
+# contiguous copy of X just to hash it
+_HASH_CHUNK_BYTES = 1 << 24
+
+
+def hash_array(X):
+    """Returns a hex digest of the shape, dtype and raw bytes of array `X`.
+    Sparse matrices are hashed by their CSR components, never densified"""
+    if issparse(X):
+        X = X.tocsr()
+        h = hashlib.sha1()
+        h.update(('sparse%s' % (X.shape,)).encode('ascii'))
+        for arr in (X.indptr, X.indices, X.data):
+            h.update(hash_array(arr).encode('ascii'))
+        return h.hexdigest()
+
+    X = np.asanyarray(X)
+    h = hashlib.sha1()
+    h.update(str(X.shape).encode('ascii'))
+    h.update(str(X.dtype.str).encode('ascii'))
+    if X.ndim == 0 or X.size == 0:
+        h.update(X.tobytes())
+        return h.hexdigest()
+
+    row_bytes = max(1, X[0].nbytes)
+    step = max(1, _HASH_CHUNK_BYTES // row_bytes)
+    for i in range(0, len(X), step):
+        h.update(np.ascontiguousarray(X[i:i + step]).data)
+
+    return h.hexdigest()
+
+
+class EmbeddingCache(object):
+    """Size-bounded, least-recently-used cache of arrays stored on disk.
+
+    Each entry is a single compressed .npz file named by its key. Reading an
+    entry refreshes its modification time, and entries with the oldest
+    modification time are evicted once the cache grows past `max_bytes`.
+
+    Parameters
+    ------
+    cache_dir: str
+        Directory to store cached entries in. Created if it does not exist.
+
+    max_bytes: int, default=2**30
+        Maximum total size of all entries in `cache_dir`. If None, the cache
+        is never evicted.
+    """
+    def __init__(self, cache_dir, max_bytes=2 ** 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def __repr__(self):
+        return ("EmbeddingCache(cache_dir=%r, max_bytes=%r, hits=%i, "
+                "misses=%i)" % (self.cache_dir, self.max_bytes, self.hits,
+                                self.misses))
+
+    @staticmethod
+    def make_key(digest, **params):
+        """Combines an array digest (see `hash_array`) with the parameters
+        used to compute an entry into a single key"""
+        blob = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha1((digest + blob).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, '%s.npz' % key)
+
+    def get(self, key):
+        """Returns dict of arrays stored under `key`, or None if missing"""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as f:
+                ret = dict((k, f[k]) for k in f.files)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # mark as recently used
+        os.utime(path, None)
+        self.hits += 1
+        return ret
+
+    def put(self, key, **arrays):
+        """Stores `arrays` under `key`, then evicts old entries if needed"""
+        # write to a temp file and rename so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.rename(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def entries(self):
+        """Returns list of (mtime, size, path) of cached entries, oldest
+        first"""
+        ret = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith('.npz'):
+                continue
+            path = os.path.join(self.cache_dir, fn)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            ret.append((st.st_mtime, st.st_size, path))
+
+        return sorted(ret)
+
+    def evict(self):
+        """Removes least-recently-used entries until the total size of the
+        cache is within `max_bytes`"""
+        if self.max_bytes is None:
+            return
+
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Removes all entries from the cache"""
+        for _, _, path in self.entries():
+            os.remove(path)
+
+    def stats(self):
+        """Returns dict of hit/miss counts and current size of the cache"""
+        entries = self.entries()
+        return {'hits': self.hits, 'misses': self.misses,
+                'n_entries': len(entries),
+                'n_bytes': sum(size for _, size, _ in entries)}
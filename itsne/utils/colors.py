@@ -55,34 +55,97 @@ def hex_to_rgb(value):
 
 def rgb_to_hex(rgb):
     """Converts iterable rgb array to hex string. Can also be an iterable
-    containing rgb arrays, in which this will return a list of hex strings"""
-    rgb = np.array(rgb)
+    containing rgb arrays, in which this will return an array of hex strings.
+    Each distinct color is formatted only once."""
+    rgb = np.asarray(rgb)
     shape = rgb.shape
     # if tuple/iterable of len(3) -- aka single RGB
-    if shape == (3L,):
+    if shape == (3,):
         ret = '#%02x%02x%02x' % tuple(rgb)
-    # else if rgb is a batch of rgbs, recursively use rgb_to_hex
-    elif shape[1] == 3:
-        ret = np.array([rgb_to_hex(x) for x in rgb])
+    # else if rgb is a batch of rgbs, format unique colors and gather
+    elif len(shape) == 2 and shape[1] == 3:
+        rgb = rgb.astype(np.int64)
+        packed = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+        uniques, inverse = np.unique(packed, return_inverse=True)
+        hexes = np.array(['#%06x' % c for c in uniques])
+        ret = hexes[inverse.reshape(-1)]
     else:
         raise RuntimeError("Do not understand %s to convert to hex" % rgb)
 
     return ret
 
 
+def generate_palette(n, seed=0):
+    """Generates `n` distinct RGB colors, shape (n, 3) in [0, 255]. The first
+    colors are the tableau20 colors, the rest are spread around the hue
+    circle by the golden ratio with varying saturation & value."""
+    if n <= len(tableau20):
+        return tableau20[:n].copy()
+
+    m = n - len(tableau20)
+    rng = np.random.RandomState(seed)
+    h = (rng.rand() + np.arange(m) * 0.618033988749895) % 1.0
+    s = 0.45 + 0.5 * ((np.arange(m) * 0.381966) % 1.0)
+    v = 0.65 + 0.3 * ((np.arange(m) * 0.7548776662) % 1.0)
+
+    # vectorized HSV -> RGB
+    i = np.floor(h * 6).astype(int) % 6
+    f = h * 6 - np.floor(h * 6)
+    p, q, t = v * (1 - s), v * (1 - f * s), v * (1 - (1 - f) * s)
+    choices = np.array([[v, t, p], [q, v, p], [p, v, t],
+                        [p, q, v], [t, p, v], [v, p, q]])
+    rgb = choices[i, :, np.arange(m)]
+    rgb = np.round(rgb * 255).astype(tableau20.dtype)
+
+    return np.concatenate([tableau20, rgb])
+
+
 def get_rng_color(n=1, normed=True, color_list=tableau20):
-    """Gets random `n` RGB values from tableau20 list"""
+    """Gets random `n` distinct RGB values from `color_list`. If `n` is
+    larger than `color_list`, colors are taken from `generate_palette(n)`"""
+    color_list = np.asarray(color_list)
     if n > len(color_list):
-        raise RuntimeError("len(color_list) !> n [%i !> %i]"
-                           % (len(color_list), n))
+        color_list = generate_palette(n)
     idxs = np.random.choice(np.arange(len(color_list)), size=n, replace=False)
-    rgbs = tableau20[idxs]
+    rgbs = color_list[idxs]
     if normed:
         rgbs = np.divide(rgbs, 255.)
 
     return rgbs
 
 
+def factorize(arr):
+    """Returns (uniques, codes) such that uniques[codes] == arr, where codes
+    is an integer array"""
+    uniques, codes = np.unique(np.asarray(arr), return_inverse=True)
+    return uniques, codes.reshape(-1)
+
+
+def get_color_palette(arr, colors='random', normed=True):
+    """Like `get_color_arr`, but returns (palette, codes) instead of a color
+    per element, where `palette[codes]` is the color of each element of `arr`
+    and `palette` has one color per unique element of `arr`."""
+    uniques, codes = factorize(arr)
+
+    if isinstance(colors, dict):
+        # check if all unique(arr) are present in keys of colors
+        color_keys = np.sort(list(colors.keys()))
+        if not np.all(np.isin(uniques, color_keys)):
+            raise RuntimeError("Unique values of `arr` are not all contained"
+                               "within keys of `colors`. Found \n"
+                               "unique(arr) = %s\n"
+                               "colors.keys() = %s"
+                               % (list(uniques), list(color_keys)))
+        palette = np.array([colors[u] for u in uniques])
+
+    elif colors == 'random':
+        palette = get_rng_color(n=len(uniques), normed=normed)
+    else:
+        raise RuntimeError("Do not recognize colors = %s" % colors)
+
+    return palette, codes
+
+
 def get_color_arr(arr, colors='random', normed=True):
     """
     Returns a list of colors corresponding to each element in `arr`.
@@ -107,23 +170,5 @@ def get_color_arr(arr, colors='random', normed=True):
         `arr`, mapped by unique elements of arr. If normed is True,
         returns RGB values between [0, 1.0], else returns values in [0, 255]
     """
-    uniques = np.unique(arr)
-
-    if isinstance(colors, dict):
-        # check if all keys of colors are present in unique(arr)
-        color_keys = np.sort(colors.keys())
-        if not np.all(np.equal(color_keys, uniques)):
-            raise RuntimeError("Unique values of `arr` are not all contained"
-                               "within keys of `colors`. Found \n"
-                               "unique(arr) = %s\n"
-                               "colors.keys() = %s"
-                               % (list(uniques), list(color_keys)))
-
-    elif colors == 'random':
-        rng_colors = get_rng_color(n=len(uniques), normed=normed)
-        colors = dict(zip(uniques, rng_colors))
-    else:
-        raise RuntimeError("Do not recognize colors = %s" % colors)
-
-    color_arr = np.array([colors[x] for x in arr])
-    return color_arr
+    palette, codes = get_color_palette(arr, colors=colors, normed=normed)
+    return palette[codes]
@@ -33,12 +33,20 @@
 """
 Utility functions for generating necessary datasets for example visualizations.
 """
+import io
+import json
+import multiprocessing
 import numpy as np
 import os
-from PIL import Image
 
+# file names within a dataset directory created by `csv_to_npy`
+_META_FN = 'meta.json'
+_FEATURES_FN = 'features.npy'
+_UIDS_FN = 'uids.npy'
+_LABELS_FN = 'labels.npy'
 
-def generate_mnist_images(X, uids, output_dir):
+
+def generate_mnist_images(X, uids, output_dir, n_jobs=None):
     """Generates a directory to store mnist images in .png format.
 
     Parameters
@@ -51,16 +59,317 @@ def generate_mnist_images(X, uids, output_dir):
 
     output_dir: str
         Directory to output images to
+
+    n_jobs: int, default=None
+        Number of worker processes. If None, uses all cores.
+    """
+    generate_thumbnails(X, uids, output_dir, img_shape=(28, 28),
+                        n_jobs=n_jobs)
+
+
+def _encode_png(x, img_shape):
+    """Returns PNG encoded bytes of row `x` reshaped to `img_shape`"""
+    from PIL import Image
+    img = Image.fromarray(np.asarray(x).reshape(img_shape).astype(np.uint8))
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def _write_png_chunk(args):
+    """Worker: writes one PNG per row of a chunk into a directory. Files are
+    written to a temp name and renamed, so partial files are never left"""
+    X, uids, img_shape, output_dir = args
+    for uid, x in zip(uids, X):
+        path = os.path.join(output_dir, '%s.png' % uid)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(_encode_png(x, img_shape))
+        os.rename(path + '.tmp', path)
+    return len(uids)
+
+
+def _encode_png_chunk(args):
+    """Worker: returns list of (uid, png bytes) for a chunk of rows"""
+    X, uids, img_shape = args
+    return [(uid, _encode_png(x, img_shape)) for uid, x in zip(uids, X)]
+
+
+def _read_pack_index(index_path):
+    """Returns (entries, n_bytes): list of (uid, offset, length) from a pack
+    index file, and the size in bytes of its complete lines. Lines from an
+    interrupted, partial write (and anything after them) are ignored"""
+    entries = []
+    n_bytes = 0
+    if not os.path.exists(index_path):
+        return entries, n_bytes
+    with open(index_path, 'rb') as f:
+        for line in f:
+            parts = line.decode('utf-8').rstrip('\n').split('\t')
+            if len(parts) != 3 or not line.endswith(b'\n'):
+                break
+            entries.append((parts[0], int(parts[1]), int(parts[2])))
+            n_bytes += len(line)
+    return entries, n_bytes
+
+
+def generate_thumbnails(X, uids, output, img_shape, n_jobs=None,
+                        chunk_size=1000, packed=False):
+    """Encodes each row of X as a PNG thumbnail, in parallel and resumable.
+
+    Work is split into chunks of rows handed to a pool of worker processes.
+    Thumbnails that already exist are skipped, so rerunning after an
+    interruption (or after adding rows) only encodes the missing ones.
+
+    Parameters
+    ------
+    X: ndarray of shape (n_samples, prod(img_shape))
+        Raw pixel values per sample. May be a np.memmap.
+
+    uids: ndarray of shape (n_samples,)
+        Unique ids of the rows of X, used to name the thumbnails.
+
+    output: str
+        If `packed` is False, directory to write `<uid>.png` files to.
+        Else, path of a single archive file, see `PackedImages`.
+
+    img_shape: tuple
+        Shape to reshape each row to, e.g. (28, 28) or (32, 32, 3).
+
+    n_jobs: int, default=None
+        Number of worker processes. If None, uses all cores.
+
+    chunk_size: int, default=1000
+        Number of rows sent to a worker at a time.
+
+    packed: bool, default=False
+        Whether to write all thumbnails into one archive file with an offset
+        index (`<output>.idx`) instead of one file per thumbnail.
+
+    Returns
+    ------
+    n_written: int
+        Number of thumbnails encoded by this call.
     """
     if len(X) != len(uids):
         raise RuntimeError("len(X) != len(uids) (%s != %s)"
                            % (len(X), len(uids)))
+    uids = np.asarray(uids)
+
+    if packed:
+        entries, _ = _read_pack_index(output + '.idx')
+        done = set(uid for uid, _, _ in entries)
+    else:
+        if not os.path.exists(output):
+            os.makedirs(output)
+        done = set(fn[:-len('.png')] for fn in os.listdir(output)
+                   if fn.endswith('.png'))
+    todo = np.array([i for i, uid in enumerate(uids) if str(uid) not in done],
+                    dtype=int)
+    if len(todo) == 0:
+        return 0
+
+    def chunks():
+        for start in range(0, len(todo), chunk_size):
+            idx = todo[start:start + chunk_size]
+            yield np.asarray(X[idx]), uids[idx]
+
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        if not packed:
+            jobs = ((x, u, img_shape, output) for x, u in chunks())
+            n_written = sum(pool.imap(_write_png_chunk, jobs))
+        else:
+            n_written = 0
+            jobs = ((x, u, img_shape) for x, u in chunks())
+            entries, idx_end = _read_pack_index(output + '.idx')
+            end = entries[-1][1] + entries[-1][2] if entries else 0
+            with open(output, 'ab') as f_pack, \
+                    open(output + '.idx', 'ab') as f_idx:
+                # drop bytes of a partial write not recorded in the index,
+                # and the partial index line itself
+                f_pack.truncate(end)
+                f_pack.seek(end)
+                f_idx.truncate(idx_end)
+                f_idx.seek(idx_end)
+                for encoded in pool.imap(_encode_png_chunk, jobs):
+                    lines = []
+                    for uid, blob in encoded:
+                        f_pack.write(blob)
+                        lines.append('%s\t%i\t%i\n' % (uid, end, len(blob)))
+                        end += len(blob)
+                    # data must hit disk before the index refers to it
+                    f_pack.flush()
+                    os.fsync(f_pack.fileno())
+                    f_idx.write(''.join(lines).encode('utf-8'))
+                    f_idx.flush()
+                    n_written += len(encoded)
+    finally:
+        pool.close()
+        pool.join()
+
+    return n_written
+
+
+class PackedImages(object):
+    """Read access to an image archive written by
+    `generate_thumbnails(..., packed=True)`.
+
+    Parameters
+    ------
+    path: str
+        Path of the archive. Its index is read from `<path>.idx`.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = dict((uid, (offset, length)) for uid, offset, length
+                          in _read_pack_index(path + '.idx')[0])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, uid):
+        return str(uid) in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def read_bytes(self, uid):
+        """Returns encoded bytes of image `uid`"""
+        offset, length = self.index[str(uid)]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def open(self, uid):
+        """Returns PIL.Image of image `uid`"""
+        from PIL import Image
+        return Image.open(io.BytesIO(self.read_bytes(uid)))
+
+
+def _count_rows(path, chunk_bytes=1 << 24):
+    """Counts number of non-header lines in a text file"""
+    n_lines, last = 0, b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(chunk_bytes)
+            if not buf:
+                break
+            n_lines += buf.count(b'\n')
+            last = buf[-1:]
+    if last != b'\n':
+        n_lines += 1
+    return n_lines - 1
+
+
+def csv_to_npy(csv_path, output_dir, uid_col='uid', label_col='label',
+               dtype=np.float32, chunksize=10000):
+    """One-time conversion of a CSV of features to a directory of .npy files
+    that can be memory-mapped by `load_npy_dataset`.
+
+    The CSV is streamed in chunks of `chunksize` rows straight into an
+    on-disk .npy memmap, so the whole CSV is never held in memory.
+
+    Parameters
+    ------
+    csv_path: str
+        CSV with a header row. All columns other than `uid_col` and
+        `label_col` are treated as features.
+
+    output_dir: str
+        Directory to write features.npy, uids.npy, labels.npy & meta.json to.
+
+    uid_col, label_col: str, default='uid', 'label'
+        Names of the uid & label columns. If a column is not present in the
+        CSV, or is None, its file is not written.
+
+    dtype: numpy dtype, default=np.float32
+        dtype to store features as, e.g. np.uint8 for raw pixels.
+
+    chunksize: int, default=10000
+        Number of CSV rows parsed at a time.
+    """
+    import pandas as pd
 
-    # make dir if not exists
     if not os.path.exists(output_dir):
-        os.mkdir(output_dir)
+        os.makedirs(output_dir)
 
-    H, W = (28, 28)  # to reshape X to image size
-    for uid, x in zip(uids, X):
-        img = Image.fromarray(x.reshape(H, W).astype(np.uint8))
-        img.save(os.path.join(output_dir, '%s.png' % uid))
+    n_rows = _count_rows(csv_path)
+    columns = list(pd.read_csv(csv_path, nrows=0).columns)
+    has_uid = uid_col is not None and uid_col in columns
+    has_label = label_col is not None and label_col in columns
+    feature_cols = [c for c in columns
+                    if not (has_uid and c == uid_col)
+                    and not (has_label and c == label_col)]
+
+    X = np.lib.format.open_memmap(os.path.join(output_dir, _FEATURES_FN),
+                                  mode='w+', dtype=dtype,
+                                  shape=(n_rows, len(feature_cols)))
+    uids, labels = [], []
+    n_done = 0
+    for df in pd.read_csv(csv_path, chunksize=chunksize):
+        if has_uid:
+            uids.append(df.pop(uid_col).values)
+        if has_label:
+            labels.append(df.pop(label_col).values)
+        if n_done + len(df) > n_rows:
+            raise RuntimeError("CSV has more rows than counted (%s)" % n_rows)
+        X[n_done:n_done + len(df)] = df[feature_cols].values
+        n_done += len(df)
+
+    if n_done != n_rows:
+        raise RuntimeError("Parsed %s rows but counted %s rows in %s. Does "
+                           "the file contain blank lines?"
+                           % (n_done, n_rows, csv_path))
+    X.flush()
+    del X
+
+    # strings are stored as fixed-width unicode so no pickling is needed
+    for has, fn, arrs in ((has_uid, _UIDS_FN, uids),
+                          (has_label, _LABELS_FN, labels)):
+        if has:
+            arr = np.concatenate(arrs)
+            if arr.dtype == object:
+                arr = arr.astype(np.str_)
+            np.save(os.path.join(output_dir, fn), arr)
+
+    meta = {'n_samples': n_rows, 'n_features': len(feature_cols),
+            'dtype': np.dtype(dtype).str, 'feature_names': feature_cols,
+            'has_uids': has_uid, 'has_labels': has_label,
+            'source': os.path.abspath(csv_path)}
+    with open(os.path.join(output_dir, _META_FN), 'w') as f:
+        json.dump(meta, f)
+
+
+def load_npy_dataset(dataset_dir, mmap_mode='r'):
+    """Loads a dataset directory written by `csv_to_npy`.
+
+    Parameters
+    ------
+    dataset_dir: str
+        Directory written by `csv_to_npy`.
+
+    mmap_mode: str, default='r'
+        Memory-map mode for the features (see `np.load`). With 'r' nothing is
+        read from disk until it is accessed. If None, loads into memory.
+
+    Returns
+    ------
+    X: ndarray (np.memmap if `mmap_mode` is set) of shape
+        (n_samples, n_features)
+
+    uids, labels: ndarray of shape (n_samples,), or None if not stored
+
+    meta: dict
+        Contents of meta.json.
+    """
+    with open(os.path.join(dataset_dir, _META_FN), 'r') as f:
+        meta = json.load(f)
+
+    X = np.load(os.path.join(dataset_dir, _FEATURES_FN), mmap_mode=mmap_mode)
+    uids = labels = None
+    if meta['has_uids']:
+        uids = np.load(os.path.join(dataset_dir, _UIDS_FN))
+    if meta['has_labels']:
+        labels = np.load(os.path.join(dataset_dir, _LABELS_FN))
+
+    return X, uids, labels, meta
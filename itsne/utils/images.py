@@ -0,0 +1,215 @@
+# COPYRIGHT
+# ---------
+# All contributions by Long Van Ho:
+# Copyright (c) 2015 Long Van Ho
+# All rights reserved.
+#
+# All other contributions:
+# Copyright (c) 2015, the respective contributors.
+# All rights reserved.
+#
+# LICENSE
+# ---------
+# The MIT License (MIT)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN
+# ==============================================================================
+
+"""
+Concurrent loading of image thumbnails with an in-process decoded-image cache.
+"""
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+
+class LRUCache(object):
+    """Thread-safe least-recently-used mapping holding at most `max_items`"""
+    def __init__(self, max_items=10000):
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getstate__(self):
+        # cached items and the lock are not shipped to other processes
+        return {'max_items': self.max_items}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_items'])
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ImageList(object):
+    """List of equally shaped in-memory images that can be passed as `imgs`
+    to `plot_tsne` without first stacking all of them into one array; only
+    the rows drawn are stacked"""
+    def __init__(self, imgs):
+        self.imgs = imgs
+
+    def __len__(self):
+        return len(self.imgs)
+
+    @property
+    def shape(self):
+        """Shape of the full stack, (n_images, H, W[, C])"""
+        return (len(self),) + np.shape(self.imgs[0])
+
+    def __getitem__(self, idxs):
+        if np.isscalar(idxs):
+            return np.asarray(self.imgs[int(idxs)])
+        if isinstance(idxs, slice):
+            idxs = np.arange(len(self))[idxs]
+        if not len(idxs):
+            first = np.asarray(self.imgs[0])
+            return np.empty((0,) + first.shape, dtype=first.dtype)
+        return np.stack([np.asarray(self.imgs[i]) for i in idxs])
+
+
+class ImageSource(object):
+    """Lazily loaded stack of images that can be passed as `imgs` to
+    `plot_tsne`, which then only loads the rows it actually draws.
+
+    Images are decoded (and optionally downsampled) on a thread pool straight
+    into one preallocated array. Decoded images are kept in an LRU cache on
+    the source, so repeated `plot_tsne` calls reuse them.
+
+    Parameters
+    ------
+    paths: list of str
+        Path of each image. All images must decode to the same shape.
+
+    size: tuple (W, H), default=None
+        If provided, images are resized to this size after decoding.
+
+    mode: str, default=None
+        If provided, images are converted to this PIL mode (e.g. 'L', 'RGB',
+        'RGBA') after decoding.
+
+    n_threads: int, default=8
+        Number of decoding threads.
+
+    cache_size: int, default=10000
+        Maximum number of decoded images kept in memory.
+    """
+    def __init__(self, paths, size=None, mode=None, n_threads=8,
+                 cache_size=10000):
+        self.paths = list(paths)
+        self.size = tuple(size) if size is not None else None
+        self.mode = mode
+        self.n_threads = n_threads
+        self.cache = LRUCache(cache_size)
+        self._packed = None
+        self._shape = None
+
+    @classmethod
+    def from_packed(cls, packed, uids, **kwargs):
+        """Creates source reading images `uids` from a
+        `datasets.PackedImages` archive"""
+        src = cls([str(uid) for uid in uids], **kwargs)
+        src._packed = packed
+        return src
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def shape(self):
+        """Shape of the full stack, (n_images, H, W[, C])"""
+        if self._shape is None:
+            self._shape = self._decode(0).shape
+        return (len(self),) + self._shape
+
+    def _decode(self, i):
+        img = self.cache.get(i)
+        if img is not None:
+            return img
+
+        from PIL import Image
+        if self._packed is not None:
+            pil_img = self._packed.open(self.paths[i])
+        else:
+            pil_img = Image.open(self.paths[i])
+        if self.mode is not None and pil_img.mode != self.mode:
+            pil_img = pil_img.convert(self.mode)
+        if self.size is not None and pil_img.size != self.size:
+            pil_img = pil_img.resize(self.size, Image.LANCZOS)
+        img = np.asarray(pil_img)
+
+        self.cache.put(i, img)
+        return img
+
+    def load(self, idxs=None):
+        """Returns ndarray of shape (len(idxs), H, W[, C]) of images `idxs`,
+        or of all images if None"""
+        if idxs is None:
+            idxs = np.arange(len(self))
+        idxs = np.asarray(idxs, dtype=int)
+
+        first = self._decode(idxs[0]) if len(idxs) else self._decode(0)
+        out = np.empty((len(idxs),) + first.shape, dtype=first.dtype)
+
+        def fill(j):
+            img = self._decode(idxs[j])
+            if img.shape != first.shape:
+                raise RuntimeError("Image %s has shape %s, expected %s"
+                                   % (self.paths[idxs[j]], img.shape,
+                                      first.shape))
+            out[j] = img
+
+        pool = ThreadPool(self.n_threads)
+        try:
+            pool.map(fill, range(len(idxs)))
+        finally:
+            pool.close()
+            pool.join()
+
+        return out
+
+    def __getitem__(self, idxs):
+        if np.isscalar(idxs):
+            return self._decode(int(idxs))
+        if isinstance(idxs, slice):
+            idxs = np.arange(len(self))[idxs]
+        return self.load(idxs)
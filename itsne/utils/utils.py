@@ -33,6 +33,7 @@
 """
 General python utility functions
 """
+import sys
 import numpy as np
 
 
@@ -49,6 +50,37 @@ def update_dict(cfg, c):
             cfg[k] = v
 
 
+def issparse(X):
+    """Same as `scipy.sparse.issparse`, but without importing scipy.sparse:
+    if nothing imported it yet, X can't be sparse"""
+    sparse = sys.modules.get('scipy.sparse')
+    return sparse is not None and sparse.issparse(X)
+
+
+def as_float(X, chunk_size=10000):
+    """Returns X itself if it has a floating point dtype, otherwise a
+    float32 copy of it, converted `chunk_size` rows at a time so integer X
+    (e.g. a uint8 memmap of pixels) is never upcast to float64 as a whole"""
+    if X.dtype.kind == 'f':
+        return X
+    if issparse(X):
+        return X.astype(np.float32)
+
+    out = np.empty(X.shape, dtype=np.float32)
+    for start in range(0, len(X), chunk_size):
+        out[start:start + chunk_size] = X[start:start + chunk_size]
+    return out
+
+
+def read_rows(X, start, stop, dtype=None):
+    """Returns rows start:stop of X (e.g. a chunk of a np.memmap) as an
+    ndarray, or kept sparse if X is sparse, cast to `dtype` if given"""
+    rows = X[start:stop]
+    if issparse(rows):
+        return rows if dtype is None else rows.astype(dtype)
+    return np.asarray(rows, dtype=dtype)
+
+
 def get_rng_samples(labels, with_label, n_samples):
     """Get `n_samples` random indexes from labels such that
     labels == with_label. Returns ndarray of indexes"""
@@ -62,14 +94,30 @@ def get_rng_samples(labels, with_label, n_samples):
     return idxs
 
 
-def sample_n_per_label(labels, n_samples):
+def sample_n_per_label(labels, n_samples, random_state=None):
     """Get `n_samples` random indexes from labels for each unique label in
-    `labels`. Returns ndarray of indexes"""
-    labels = np.array(labels)  # make sure its ndarray just in case
-    unique_labels = np.unique(labels)
-    idxs = []
-    for u_lbl in unique_labels:
-        idxs = np.concatenate(
-                  [idxs, get_rng_samples(labels, u_lbl, n_samples)])
-
-    return np.array(idxs, dtype=int)
+    `labels`. Labels with fewer than `n_samples` items contribute all of
+    their indexes. Returns ndarray of indexes, grouped by sorted label.
+
+    Runs in a single pass over `labels` (one permutation + one stable sort),
+    independent of the number of unique labels. `random_state` is an int
+    seed or np.random.RandomState."""
+    labels = np.asarray(labels)  # make sure its ndarray just in case
+    if isinstance(random_state, np.random.RandomState):
+        rng = random_state
+    else:
+        rng = np.random.RandomState(random_state)
+
+    _, codes = np.unique(labels, return_inverse=True)
+    codes = codes.reshape(-1)
+
+    # random order, then group by label keeping the random order within
+    perm = rng.permutation(len(codes))
+    order = perm[np.argsort(codes[perm], kind='mergesort')]
+
+    # rank of each item within its label group
+    counts = np.bincount(codes)
+    starts = np.cumsum(counts) - counts
+    ranks = np.arange(len(order)) - np.repeat(starts, counts)
+
+    return order[ranks < n_samples].astype(int)
@@ -0,0 +1,23 @@
+import sys
+import numpy as np
+import pytest
+
+from itsne.instrument import StageProfiler
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason="RSS is read from /proc")
+def test_peak_rss_of_freed_allocation():
+    profiler = StageProfiler()
+    with profiler.stage('big'):
+        a = np.ones(200 * 2 ** 20 // 8)
+        del a
+    with profiler.stage('small'):
+        a = np.ones(20 * 2 ** 20 // 8)
+        del a
+
+    big, small = profiler.records
+    assert big['peak_rss_bytes'] - big['rss_start_bytes'] > 150 * 2 ** 20
+    # not hidden behind the earlier, larger peak
+    assert small['peak_rss_bytes'] - small['rss_start_bytes'] < 100 * 2 ** 20
+    assert small['max_rss_bytes'] >= big['peak_rss_bytes']
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+from itsne.model import EmbeddingModel
+
+
+def test_save_load_sparse():
+    rng = np.random.RandomState(0)
+    X = rng.rand(60, 20)
+    X[X < 0.7] = 0
+    X = csr_matrix(X)
+    xy = rng.randn(60, 2)
+    model = EmbeddingModel.from_embedding(X, xy, n_neighbors=5,
+                                          perplexity=2.)
+
+    path = os.path.join(tempfile.mkdtemp(), 'model.npz')
+    model.save(path)
+    loaded = EmbeddingModel.load(path)
+
+    assert issparse(loaded.X_)
+    assert (loaded.X_ != model.X_).nnz == 0
+    np.testing.assert_array_equal(loaded.xy_, model.xy_)
+    np.testing.assert_allclose(loaded.transform(X[:10], n_iter=0),
+                               model.transform(X[:10], n_iter=0))
+
+
+def test_save_load_dense():
+    rng = np.random.RandomState(0)
+    X = rng.rand(60, 20)
+    model = EmbeddingModel.from_embedding(X, rng.randn(60, 2),
+                                          n_neighbors=5, perplexity=2.)
+
+    path = os.path.join(tempfile.mkdtemp(), 'model.npz')
+    model.save(path)
+    loaded = EmbeddingModel.load(path)
+
+    np.testing.assert_array_equal(loaded.X_, model.X_)
+    np.testing.assert_array_equal(loaded.xy_, model.xy_)
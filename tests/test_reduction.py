@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+
+from itsne.reduction import reduce_dims
+
+
+@pytest.mark.parametrize('method', ['pca', 'randomized_pca'])
+def test_pca_caps_components_at_n_samples(method):
+    X = np.random.RandomState(0).rand(30, 100)
+    X_red = reduce_dims(X, method=method, n_components=50, chunk_size=10,
+                        random_state=0)
+    assert X_red.shape == (30, 30)
+    assert np.isfinite(X_red).all()
@@ -0,0 +1,39 @@
+import os
+import tempfile
+import numpy as np
+import pytest
+
+from itsne.itsne import compute_tsne, render_tsne
+
+
+@pytest.mark.parametrize('img_mode', ['glyph', 'atlas'])
+@pytest.mark.parametrize('compact', [False, True])
+def test_max_bytes(compact, img_mode):
+    rng = np.random.RandomState(0)
+    n, max_bytes = 600, 200000
+    result = compute_tsne(rng.rand(n, 5), uids=np.arange(n),
+                          labels=rng.randint(0, 10, n),
+                          xy=rng.rand(n, 2) * 100)
+    imgs = rng.randint(0, 256, (n, 28, 28)).astype(np.uint8)
+
+    out = os.path.join(tempfile.mkdtemp(), 'out.html')
+    render_tsne(out, result, imgs=imgs, img_level=1, img_mode=img_mode,
+                compact=compact, max_bytes=max_bytes)
+    assert os.path.getsize(out) <= max_bytes * 1.1
+
+
+def test_compact_factorizes_repeated_uids():
+    rng = np.random.RandomState(0)
+    n = 200
+    uids = np.array(['sample_%i' % (i % 20) for i in range(n)])
+    result = compute_tsne(rng.rand(n, 5), uids=uids,
+                          labels=rng.randint(0, 3, n), xy=rng.rand(n, 2))
+
+    out = os.path.join(tempfile.mkdtemp(), 'out.html')
+    p = render_tsne(out, result, compact=True)
+    source = [r.data_source for r in p.renderers
+              if 'uids' in r.data_source.data][0]
+    assert source.data['uids'].dtype.kind in 'iu'
+    hover = [t for t in p.tools if hasattr(t, 'formatters')][0]
+    table = hover.formatters['@uids'].args['table']
+    assert [table[i] for i in source.data['uids']] == list(uids)